@@ -0,0 +1,90 @@
+"""Compares circuit evaluation and fitting through the impedance package with the compiled circuits in laboratory.modelling.
+
+Run from the repository root with::
+
+    python benchmarks/circuits.py
+"""
+import os
+import sys
+import time
+import numpy as np
+from impedance.models.circuits import CustomCircuit, fitting
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from laboratory import modelling
+
+CIRCUITS = {
+    'p(R1,C1)-p(R2,C2)': [1e+5, 1e-10, 5e+6, 1e-10],
+    'R0-p(R1,CPE1)-W1': [100, 1e+5, 1e-9, 0.8, 300],
+}
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+def synthetic(circuit, true, freq, n, noise=0.01, seed=0):
+    """n spectra from parameters scattered around the true values, with multiplicative noise. CPE exponents are kept at their true value so they stay physical (at most 1)."""
+    rng = np.random.default_rng(seed)
+    compiled = modelling.CompiledCircuit(circuit)
+    exponent = np.array([name.startswith('CPE') and name.endswith('_1') for name in compiled.names])
+    params = np.array(true) * np.where(exponent, 1, rng.uniform(0.5, 2, (n, len(true))))
+    Z = compiled(params, freq)
+    Z = Z * (1 + noise * (rng.standard_normal(Z.shape) + 1j * rng.standard_normal(Z.shape)))
+    return params, Z
+
+def main(n=200, serial=20, tolerance=1.5):
+    """Times n batched fits per circuit against the first serial of them fitted one at a time. The batched speedup is only reported if every batched fit has an rmse within tolerance times that of the successful serial fit of the same spectrum."""
+    freq = np.geomspace(20, 2e+6, 50)
+    for circuit, true in CIRCUITS.items():
+        print(circuit)
+        compiled = modelling.CompiledCircuit(circuit)
+        wrapped = fitting.wrapCircuit(circuit, {})
+        p = np.array(true)
+
+        t_wrapped = timed(lambda: wrapped(freq, *p), 200)
+        t_compiled = timed(lambda: compiled(p, freq, jacobian=True), 200)
+        print('  evaluate   impedance {:8.1f} us   compiled + jacobian {:8.1f} us'.format(
+            t_wrapped * 1e6, t_compiled * 1e6))
+
+        params, spectra = synthetic(circuit, true, freq, n)
+
+        fits = {}
+
+        def impedance_fits():
+            for z in spectra[:serial]:
+                model = CustomCircuit(circuit, initial_guess=true)
+                try:
+                    # maxfev as an int, the impedance package's default of 1e5 is rejected by newer scipy
+                    model.fit(freq, z, method='lm', bounds=(-np.inf, np.inf), maxfev=100000)
+                except RuntimeError:  # maxfev reached
+                    pass
+
+        def compiled_fits():
+            fits['serial'] = [modelling.fit_circuit(circuit, true, freq, z) for z in spectra[:serial]]
+
+        def batch_fit():
+            fits['batch'] = modelling.fit_batch(freq, spectra, 0, circuit, true, progress=False)
+
+        t_impedance = timed(impedance_fits, 1) / serial
+        t_native = timed(compiled_fits, 1) / serial
+        t_batch = timed(batch_fit, 1) / n
+        print('  fit        impedance {:8.2f} ms   compiled            {:8.2f} ms   ({:.1f}x)'.format(
+            t_impedance * 1e3, t_native * 1e3, t_impedance / t_native))
+
+        # a speedup only means something if the batched fits are as good as the serial ones
+        # compared where the serial fit succeeded, fit_batch leaves out fits that failed
+        serial_rmse = np.array([fit['rmse'] for fit in fits['serial']])
+        succeeded = np.array([fit['success'] for fit in fits['serial']])
+        batch_rmse = np.array([rmse for _, _, rmse in fits['batch']], dtype=float)
+        agree = np.sum(batch_rmse[:serial][succeeded] <= tolerance * serial_rmse[succeeded])
+        print('             batched   {:8.2f} ms   rmse within {}x of compiled for {}/{} spectra, {}/{} fitted'.format(
+            t_batch * 1e3, tolerance, agree, succeeded.sum(), np.isfinite(batch_rmse).sum(), n), end='')
+        if agree < succeeded.sum():
+            print('   (no speedup, the batched fits are worse)')
+        else:
+            print('   ({:.1f}x)'.format(t_impedance / t_batch))
+
+if __name__ == '__main__':
+    main()
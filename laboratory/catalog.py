@@ -0,0 +1,223 @@
+"""An index of the experiments in config.DATA_DIR, kept in an SQLite database so that listing and searching experiments doesn't require opening every folder.
+
+:Example:
+
+>>> catalog = Catalog()
+>>> catalog.update()
+>>> catalog.find(name='olivine', fo2_gas='co', temp_above=1000)
+"""
+import os
+import glob
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from laboratory import config
+from laboratory.processing import fingerprint, same_files
+
+@contextmanager
+def _connection(path):
+    db = sqlite3.connect(path)
+    try:
+        with db:
+            yield db
+    finally:
+        db.close()
+
+class Catalog():
+    """Metadata, frequency range, row counts, time span, temperature range of each fo2 gas and raw file fingerprints of every experiment folder. :meth:`update` only rereads folders whose files have changed since the last update."""
+
+    def __init__(self, directory=None, path=None):
+        """
+        Args:
+            directory (str, optional): folder containing one folder per experiment. Defaults to config.DATA_DIR.
+            path (str, optional): the database. Defaults to catalog.sqlite in directory.
+        """
+        self.directory = directory or config.DATA_DIR
+        self.path = path or os.path.join(self.directory, 'catalog.sqlite')
+        os.makedirs(self.directory, exist_ok=True)
+        with _connection(self.path) as db:
+            db.execute('CREATE TABLE IF NOT EXISTS experiments ('
+                'directory TEXT PRIMARY KEY, name TEXT, material TEXT, description TEXT, metadata TEXT, '
+                'freq_min REAL, freq_max REAL, n_freq INTEGER, n_rows INTEGER, n_conductivity INTEGER, n_thermopower INTEGER, '
+                'n_steps INTEGER, start_time TEXT, end_time TEXT, temp_min REAL, temp_max REAL, files TEXT, updated REAL)')
+            db.execute('CREATE TABLE IF NOT EXISTS gases ('
+                'directory TEXT, fo2_gas TEXT, n_rows INTEGER, temp_min REAL, temp_max REAL, '
+                'PRIMARY KEY (directory, fo2_gas))')
+
+    def __repr__(self):
+        return 'Catalog({}, {} experiments)'.format(self.directory, len(self))
+
+    def __len__(self):
+        with _connection(self.path) as db:
+            return db.execute('SELECT COUNT(*) FROM experiments').fetchone()[0]
+
+    def folders(self):
+        """Experiment folders in directory, ignoring those starting with an underscore"""
+        return sorted(d for d in os.listdir(self.directory)
+            if not d.startswith('_') and os.path.isfile(os.path.join(self.directory, d, 'sample.json')))
+
+    def update(self):
+        """Adds new experiments, rereads those whose raw files have changed (by size and modification time, then hash) and removes those whose folder is gone.
+
+        Returns:
+            list: folders that were added or reread
+        """
+        with _connection(self.path) as db:
+            known = {d: json.loads(files) for d, files in db.execute('SELECT directory, files FROM experiments')}
+
+        changed = []
+        folders = self.folders()
+        for folder in folders:
+            paths = _raw_files(os.path.join(self.directory, folder))
+            files = fingerprint(paths, known.get(folder))
+            if files == known.get(folder):
+                continue
+            if folder in known and same_files(files, known[folder]):
+                # touched but unchanged, only the modification times need updating
+                with _connection(self.path) as db:
+                    db.execute('UPDATE experiments SET files = ? WHERE directory = ?', (json.dumps(files), folder))
+                continue
+            self._add(folder, paths, files)
+            changed.append(folder)
+
+        gone = [d for d in known if d not in folders]
+        with _connection(self.path) as db:
+            for table in ['experiments', 'gases']:
+                db.executemany('DELETE FROM {} WHERE directory = ?'.format(table), [(d,) for d in gone])
+        return changed
+
+    def _add(self, folder, paths, files):
+        summary, gases = summarise(os.path.join(self.directory, folder))
+        summary.update(directory=folder, files=json.dumps(files), updated=time.time())
+        columns = list(summary)
+        with _connection(self.path) as db:
+            db.execute('INSERT OR REPLACE INTO experiments ({}) VALUES ({})'.format(
+                ','.join(columns), ','.join('?' * len(columns))), [summary[c] for c in columns])
+            db.execute('DELETE FROM gases WHERE directory = ?', (folder,))
+            db.executemany('INSERT INTO gases VALUES (?,?,?,?,?)',
+                [(folder, gas, rows, temp_min, temp_max) for gas, rows, temp_min, temp_max in gases])
+
+    def experiments(self):
+        """Every experiment in the catalog as a dataframe indexed by folder"""
+        return self.find()
+
+    def find(self, name=None, fo2_gas=None, temp_above=None, temp_below=None, after=None, before=None):
+        """Experiments matching every given condition.
+
+        Args:
+            name (str, optional): part of the sample name or material, ignoring case. Defaults to None.
+            fo2_gas (str, optional): only experiments that used this gas ('co' or 'h2'). Temperature conditions then apply to the measurements taken with this gas. Defaults to None.
+            temp_above (float, optional): only experiments with measurements at or above this temperature (degrees C). Defaults to None.
+            temp_below (float, optional): only experiments with measurements at or below this temperature (degrees C). Defaults to None.
+            after (str or datetime, optional): only experiments that ran after this time. Defaults to None.
+            before (str or datetime, optional): only experiments that started before this time. Defaults to None.
+
+        Returns:
+            pd.DataFrame: one row per matching experiment, indexed by folder
+        """
+        where, params = [], []
+        temps = 'experiments'
+        if name is not None:
+            where.append('(name LIKE ? OR material LIKE ?)')
+            params += ['%{}%'.format(name)] * 2
+        if fo2_gas is not None:
+            where.append('gases.fo2_gas = ?')
+            params.append(fo2_gas.lower())
+            temps = 'gases'
+        if temp_above is not None:
+            where.append('{}.temp_max >= ?'.format(temps))
+            params.append(temp_above)
+        if temp_below is not None:
+            where.append('{}.temp_min <= ?'.format(temps))
+            params.append(temp_below)
+        if after is not None:
+            where.append('experiments.end_time >= ?')
+            params.append(pd.Timestamp(after).isoformat())
+        if before is not None:
+            where.append('experiments.start_time <= ?')
+            params.append(pd.Timestamp(before).isoformat())
+
+        query = 'SELECT experiments.* FROM experiments'
+        if fo2_gas is not None:
+            query += ' JOIN gases ON gases.directory = experiments.directory'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+
+        with _connection(self.path) as db:
+            result = pd.read_sql_query(query + ' ORDER BY experiments.directory', db, params=params)
+        for column in ['start_time', 'end_time']:
+            result[column] = pd.to_datetime(result[column])
+        return result.set_index('directory')
+
+    def metadata(self, folder):
+        """The contents of sample.json of an experiment as stored in the catalog"""
+        with _connection(self.path) as db:
+            row = db.execute('SELECT metadata FROM experiments WHERE directory = ?', (folder,)).fetchone()
+        if row is None:
+            raise KeyError(folder)
+        return json.loads(row[0])
+
+def _raw_files(folder):
+    return sorted(glob.glob(os.path.join(folder, '*.pkl'))[:1]) + [
+        os.path.join(folder, name) for name in ['sample.json', 'control_file.csv']
+        if os.path.exists(os.path.join(folder, name))]
+
+def summarise(folder):
+    """Catalog entry of a single experiment folder, read from the raw files without processing them.
+
+    Returns:
+        tuple: (dict of experiment columns, list of (fo2_gas, n_rows, temp_min, temp_max))
+    """
+    with open(os.path.join(folder, 'sample.json')) as f:
+        metadata = json.load(f)
+    freq = np.asarray(metadata.get('freq', []), dtype=float)
+    summary = dict(
+        name = metadata.get('name'),
+        material = metadata.get('material'),
+        description = metadata.get('description'),
+        metadata = json.dumps(metadata),
+        freq_min = float(freq.min()) if len(freq) else None,
+        freq_max = float(freq.max()) if len(freq) else None,
+        n_freq = len(freq),
+        )
+
+    pickles = glob.glob(os.path.join(folder, '*.pkl'))
+    if not pickles:
+        return summary, []
+
+    data = pd.read_pickle(pickles[0])
+    temp = data[['thermo_1', 'thermo_2']].mean(axis=1)
+    conductivity = data.z.notnull() if 'z' in data else pd.Series(False, index=data.index)
+    summary.update(
+        n_rows = len(data),
+        n_conductivity = int(conductivity.sum()),
+        n_thermopower = int((~conductivity).sum()),
+        n_steps = int(data.step.nunique()),
+        start_time = data.index.min().isoformat() if len(data) else None,
+        end_time = data.index.max().isoformat() if len(data) else None,
+        temp_min = float(temp.min()),
+        temp_max = float(temp.max()),
+        )
+
+    gases = []
+    control_file = os.path.join(folder, 'control_file.csv')
+    if os.path.exists(control_file):
+        control = pd.read_csv(control_file)
+        step_gas = control['fo2_gas'] if 'step' not in control else control.set_index('step')['fo2_gas']
+        gas = data.step.map(step_gas).str.lower()
+        for name, group in temp.groupby(gas):
+            gases.append((name, len(group), float(group.min()), float(group.max())))
+    return summary, gases
+
+_CATALOGS = {}
+
+def catalog(directory=None):
+    """The shared :class:`Catalog` of directory (config.DATA_DIR by default), brought up to date"""
+    directory = directory or config.DATA_DIR
+    if directory not in _CATALOGS:
+        _CATALOGS[directory] = Catalog(directory)
+    _CATALOGS[directory].update()
+    return _CATALOGS[directory]
@@ -9,6 +9,10 @@ ROOT = os.getcwd()
 DATA_DIR = os.path.join(ROOT,'data')
 LOG_DIR = os.path.join(ROOT,'log')
 CALIBRATION_DIR = os.path.join(ROOT,'laboratory','calibration')
+CACHE_DIR = os.path.join(ROOT,'cache')
+PROCESSED_DIR = 'processed'     #folder inside each project folder where processed data is cached
+STEPS_DIR = 'steps'             #folder inside each project folder where the raw data of each step is saved
+CHUNK_ROWS = 20000              #rows per chunk when processing in chunks from data.pkl, see processing.raw_chunks
 
 GLOBAL_MAXTRY = 5
 #-------------------DAQ settings-------------------
@@ -63,4 +67,55 @@ CO_B = {'address':'C',
 
 H2 = {  'address':'D',
         'upper_limit': 50,
-        'precision':2}
\ No newline at end of file
+        'precision':2}
+
+#-------------------Gas ratio lookup tables-------------------
+GAS_TABLE = {
+    'temp_range': [200, 1400],      #in degC
+    'fugacity_range': [-30, 0],     #in log Pa
+    'ratio_range': [-4, 5],         #log10 of the gas ratio, 5 is about the limit of the flow controllers
+    'tolerance': 1e-3,              #maximum interpolation error in log units
+    'max_size': 2049,               #maximum number of grid points along each axis
+}
+
+#-------------------Circuit fit cache-------------------
+FIT_CACHE_SIZE = 500000     #maximum number of fits kept in CACHE_DIR/fits.sqlite
+
+#-------------------Candidate circuits-------------------
+# circuit string: initial guess, used by Sample.select_circuit
+CIRCUITS = {
+    'p(R1,C1)': [1e+6, 1e-10],
+    'p(R1,C1)-p(R2,C2)': [1e+5, 1e-10, 5e+6, 1e-10],
+    'p(R1,CPE1)': [1e+6, 1e-10, 0.9],
+    'p(R1,C1)-p(R2,CPE1)': [1e+5, 1e-10, 5e+6, 1e-9, 0.9],
+    'p(R1,C1)-W1': [1e+6, 1e-10, 1e+5],
+}
+
+#-------------------Kramers-Kronig validation-------------------
+KRAMERS_KRONIG = {
+    'c': 0.5,               #mu cutoff used to choose the number of RC elements, 0.85 in Schönleber et al. underfits our spectra
+    'max_elements': 50,     #maximum number of RC elements
+    'threshold': 0.03,      #rms of the residuals relative to |Z| above which a spectrum is invalid, clean spectra are below 0.01 and those with 1% noise below 0.02
+    'capacitance': True,    #fit a series capacitance as well, otherwise arcs that don't close inside the measured band fail
+}
+
+#-------------------Distribution of relaxation times-------------------
+DRT = {
+    'n_tau': 80,                            #number of relaxation times
+    'lambda_range': [-8, -1],               #log10 range of candidate regularisation parameters of the normalised problem
+    'n_lambda': 29,                         #number of candidates
+}
+
+#-------------------Live fitting during experiments-------------------
+LIVE_FIT = {
+    'circuit': 'p(R1,C1)-p(R2,C2)',
+    'guess': [1e+5, 1e-10, 5e+6, 1e-10],
+    'cutoff': 200,          #frequencies below this are ignored, in Hz
+}
+
+#-------------------Compact sample data-------------------
+# used by Sample.compact. Columns listed in float32 are read to a few significant figures, so single precision loses nothing
+COMPACT = {
+    'float32': ['co2', 'co', 'h2', 'ratio', 'voltage', 'volt_stderr'],
+    'spectra': 'complex128',    #complex64 halves the spectra again at ~7 significant figures
+}
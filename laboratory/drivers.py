@@ -1137,9 +1137,10 @@ class GasControllers():
 
         log_fugacity = processing.fo2_buffer(temp, buffer) + offset
 
-        if gas_type == 'h2':
-            ratio = processing.fugacity_h2(log_fugacity, temp)
+        if gas_type in ['h2', 'co']:
+            ratio = processing.gas_ratio_table(gas_type).ratio(log_fugacity, temp)
 
+        if gas_type == 'h2':
             if ratio < 0.5:
                 h2 = 50
                 co2 = h2*ratio
@@ -1156,8 +1157,6 @@ class GasControllers():
                           'co_b': 0, })
 
         elif gas_type == 'co':
-            ratio = processing.fugacity_co(log_fugacity, temp)
-
             # set the optimal co2 flow rate
             # higher ratios require higher co2 mass flow for greater precision
             if ratio > 1000:
@@ -11,7 +11,7 @@ import pandas as pd
 from pandas.api.types import is_numeric_dtype
 from matplotlib import colors, pyplot as plt
 
-from laboratory import calibration, config, drivers, processing, plot
+from laboratory import calibration, config, drivers, processing, plot, modelling
 from laboratory.utils import loggers
 from laboratory.utils.exceptions import SetupError
 from laboratory.widgets import CountdownTimer
@@ -154,9 +154,13 @@ class Experiment(Laboratory):
         self.project_directory = self._create_directory()
         control_file = self.setup()
         self.data = pd.DataFrame()
-        self.plot = plot.LivePlot1()
+        self.step_files = {}
+        self.plot = plot.LivePlot1(self.settings['freq'])
         self.plot2 = plot.LivePlot2(self.settings['freq'])
 
+        # fits each spectrum in another process as soon as it is measured
+        self.fitter = modelling.BackgroundFitter(self.settings['freq'])
+
         # TEMPORARY ONLY 
         self.stage.home = 5488
         self.stage.go_home()
@@ -180,7 +184,7 @@ class Experiment(Laboratory):
           
             logger.info('Step {} complete!'.format(i))
 
-
+        self.finish_fits()
         self.shutdown()
 
     def thermopower_loop(self, step, i):
@@ -259,6 +263,7 @@ class Experiment(Laboratory):
             self.get_impedance()
             data.append(self.measurement)
             self.update_progress_bar('Complete')
+            self.collect_fits(data)
             self.update_plots(data)
 
             # Turn the furnace back on
@@ -366,6 +371,10 @@ class Experiment(Laboratory):
         self.measurement.update(impedance)
         self.daq.toggle_switch('thermo')
 
+        if getattr(self, 'fitter', None) is not None:
+            spectrum = np.multiply(impedance['z'], np.exp(1j * np.array(impedance['theta'])))
+            self.fitter.submit(self.measurement['time'], spectrum)
+
     def centre_stage(self):
         """periodically corrects the stage position to within .5 degrees of equilibrium
         """
@@ -482,7 +491,53 @@ class Experiment(Laboratory):
         else:
             self.settings['freq'] =  np.around(np.linspace(min_f, max_f, num_freq))
 
+    def collect_fits(self, data=()):
+        """Adds the fits finished by the background fitter since the last call to the measurements of the current step in data, and to self.data and the step files for measurements from previous steps"""
+        if getattr(self, 'fitter', None) is None:
+            return
+        self._apply_fits(self.fitter.collect(), data)
+
+    def finish_fits(self):
+        """Waits for the background fitter to finish the remaining spectra, stops it and saves the fits to data.pkl and the files of each step"""
+        if getattr(self, 'fitter', None) is None:
+            return
+        self._apply_fits(self.fitter.close())
+        self.fitter = None
+        if not self.data.empty:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                self.data.to_pickle(os.path.join(self.project_directory,'data.pkl'))
+
+    def _apply_fits(self, fits, data=()):
+        for measurement in data:
+            fit = fits.get(measurement['time'])
+            if fit is not None:
+                measurement.update(resistance=fit['resistance'], model_rmse=fit['model_rmse'])
+
+        if self.data.empty:
+            return
+        steps = set()
+        for key, fit in fits.items():
+            if key in self.data.index:
+                self.data.loc[key, 'resistance'] = fit['resistance']
+                self.data.loc[key, 'model_rmse'] = fit['model_rmse']
+                steps.update(np.atleast_1d(self.data.loc[key, 'step']))
+
+        # steps that have already been saved to their own file
+        for step in steps:
+            path = getattr(self, 'step_files', {}).get(step)
+            if path is None:
+                continue
+            step_data = pd.read_pickle(path)
+            keys = [key for key in fits if key in step_data.index]
+            step_data.loc[keys, 'resistance'] = [fits[key]['resistance'] for key in keys]
+            step_data.loc[keys, 'model_rmse'] = [fits[key]['model_rmse'] for key in keys]
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                step_data.to_pickle(path)
+
     def save_and_export(self, data, start_time, step, i):
+        self.collect_fits(data)
 
         # convert step data to dataframe
         data = pd.DataFrame(data)
@@ -502,6 +557,12 @@ class Experiment(Laboratory):
             self.data.to_pickle(fname)
             # data.to_hdf(fname,key='step_{}'.format(i))
 
+            # each step on its own as well, so long experiments can be processed a step at a time (see processing.raw_chunks)
+            steps_folder = os.path.join(self.project_directory, config.STEPS_DIR)
+            os.makedirs(steps_folder, exist_ok=True)
+            self.step_files[i] = os.path.join(steps_folder, 'step_{:04d}_{}.pkl'.format(i, 'conductivity' if 'z' in data.keys() else 'thermopower'))
+            data.to_pickle(self.step_files[i])
+
         # save data from the present step into it's own csv file
         file_name = os.path.join(self.project_directory, 'Step {} - {}.csv'.format(i,'Conductivity' if 'z' in data.keys() else 'Thermopower'))
         
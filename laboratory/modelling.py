@@ -1,10 +1,27 @@
 from impedance import preprocessing as pp
-from impedance.models.circuits import CustomCircuit, Randles, fitting
-from impedance.visualization import plot_nyquist, plot_bode
+from impedance.models.circuits import CustomCircuit, fitting
 # from impedance import fitting
 import numpy as np
-import matplotlib.pyplot as plt
+import pandas as pd
+from scipy import optimize, linalg
 import warnings
+import os
+import re
+import time
+import queue
+import multiprocessing
+import hashlib
+import sqlite3
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+from laboratory import config
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # python < 3.8
+    shared_memory = None
 
 
 def to_complex_z(re, im):
@@ -39,9 +56,1248 @@ def model_conductivity(freq, complex_z, cutoff, circuit, guess):
         resistance: calculated resistance
         rmse: the root mean square error on the resistance
     """
-    f, z = pp.cropFrequencies(np.array(freq), complex_z, cutoff)
-    f, z = pp.ignoreBelowX(f, z)
-    model = model_impedance(circuit,guess,f, z)
-    rmse = fitting.rmse(z, model.predict(f))
+    f, z = crop(freq, complex_z, cutoff)
+    if compile_circuit(circuit) is None:
+        model = model_impedance(circuit,guess,f, z)
+        rmse = fitting.rmse(z, model.predict(f))
+    else:
+        fit = fit_circuit(circuit, guess, f, z)
+        model = fitted_model(circuit, fit['parameters'], covariance=fit['covariance'])
+        rmse = fit['rmse']
     resistance = get_resistance(model)
     return model, resistance, rmse
+
+def crop(freq, complex_z, cutoff):
+    """Removes frequencies below cutoff and any points with a positive imaginary component"""
+    f, z = pp.cropFrequencies(np.array(freq), complex_z, cutoff)
+    return pp.ignoreBelowX(f, z)
+
+class CompiledCircuit():
+    """A circuit string compiled into vectorised NumPy functions that return the impedance and its analytic Jacobian with respect to every parameter. This avoids the string parsing and eval of CustomCircuit on every call, and the finite differences otherwise needed by the optimiser.
+
+    Supports series (-) and parallel (p(...)) combinations of R, C, CPE and W elements. Parameters are ordered as in CustomCircuit, e.g. 'p(R1,CPE1)' has parameters R1, CPE1_0, CPE1_1.
+
+    :Example:
+
+    >>> circuit = CompiledCircuit('p(R1,C1)-p(R2,C2)')
+    >>> Z, J = circuit(params, freq, jacobian=True)
+    """
+    elements = {'R': 1, 'C': 1, 'CPE': 2, 'W': 1}
+
+    def __init__(self, circuit):
+        self.circuit = circuit
+        self.names = []
+        self._pos = 0
+        self._func = self._series(circuit.replace(' ', ''))
+        if self._pos != len(self.circuit.replace(' ', '')):
+            raise ValueError('Could not parse circuit {}'.format(circuit))
+
+    def __call__(self, parameters, freq, jacobian=False):
+        """Evaluates the circuit. parameters may have any number of leading dimensions, e.g. (spectra, parameters), and the result has shape (..., frequencies). If jacobian is True, also returns dZ/dp with shape (..., frequencies, parameters)."""
+        parameters = np.asarray(parameters, dtype=float)
+        omega = 2 * np.pi * np.asarray(freq, dtype=float)
+        Z, partials = self._func(parameters, omega)
+        Z = np.broadcast_to(Z, parameters.shape[:-1] + omega.shape)
+        if not jacobian:
+            return Z
+        J = np.zeros(Z.shape + (len(self.names),), dtype=complex)
+        for i, dZ in partials.items():
+            J[..., i] = dZ
+        return Z, J
+
+    def _series(self, string):
+        terms = [self._term(string)]
+        while string[self._pos:self._pos+1] == '-':
+            self._pos += 1
+            terms.append(self._term(string))
+        if len(terms) == 1:
+            return terms[0]
+
+        def series(p, omega):
+            Z, partials = 0, {}
+            for term in terms:
+                z, d = term(p, omega)
+                Z = Z + z
+                for i, dz in d.items():
+                    partials[i] = partials.get(i, 0) + dz
+            return Z, partials
+        return series
+
+    def _term(self, string):
+        if string.startswith('p(', self._pos):
+            self._pos += 2
+            branches = [self._series(string)]
+            while string[self._pos] == ',':
+                self._pos += 1
+                branches.append(self._series(string))
+            self._pos += 1  # closing bracket
+            return self._parallel(branches)
+
+        match = re.compile(r'([A-Za-z]+)(\w*)').match(string, self._pos)
+        if match is None:
+            raise ValueError('Could not parse circuit {}'.format(self.circuit))
+        self._pos = match.end()
+        return self._element(match.group(1), match.group(0))
+
+    def _parallel(self, branches):
+        def parallel(p, omega):
+            results = [branch(p, omega) for branch in branches]
+            Z = 1 / sum(1 / z for z, _ in results)
+            # dZ/dZi = Z^2 / Zi^2
+            partials = {}
+            for z, d in results:
+                factor = (Z / z) ** 2
+                for i, dz in d.items():
+                    partials[i] = partials.get(i, 0) + factor * dz
+            return Z, partials
+        return parallel
+
+    def _element(self, kind, name):
+        if kind not in self.elements:
+            raise ValueError('{} elements are not supported by CompiledCircuit'.format(kind))
+        i = len(self.names)
+        if self.elements[kind] == 1:
+            self.names.append(name)
+        else:
+            self.names.extend(['{}_{}'.format(name, j) for j in range(self.elements[kind])])
+
+        if kind == 'R':
+            def element(p, omega):
+                R = p[..., i, None] + 0j * omega
+                return R, {i: np.ones_like(R)}
+        elif kind == 'C':
+            def element(p, omega):
+                C = p[..., i, None]
+                Z = 1 / (1j * omega * C)
+                return Z, {i: -Z / C}
+        elif kind == 'CPE':
+            def element(p, omega):
+                Q, alpha = p[..., i, None], p[..., i+1, None]
+                Z = 1 / (Q * (1j * omega) ** alpha)
+                return Z, {i: -Z / Q, i+1: -Z * np.log(1j * omega)}
+        elif kind == 'W':
+            def element(p, omega):
+                dZ = (1 - 1j) / np.sqrt(omega) + 0 * p[..., i, None]
+                return p[..., i, None] * dZ, {i: dZ}
+        return element
+
+
+@lru_cache(maxsize=None)
+def compile_circuit(circuit):
+    """Returns the :class:`CompiledCircuit` for a circuit string, or None if it contains elements that can't be compiled."""
+    try:
+        return CompiledCircuit(circuit)
+    except ValueError:
+        return None
+
+def fit_circuit(circuit, guess, freq, impedance):
+    """Fits a circuit to a single spectrum by Levenberg-Marquardt (the same MINPACK routine used by CustomCircuit.fit) but also reports how much work the fit took. Circuits supported by :class:`CompiledCircuit` are evaluated natively with an analytic Jacobian, others fall back to the impedance package with finite differences.
+
+    Returns:
+        dict: parameters, conf (one standard deviation), covariance, rmse, nfev (number of function evaluations) and success
+    """
+    freq = np.asarray(freq, dtype=float)
+    measured = np.hstack([impedance.real, impedance.imag])
+    compiled = compile_circuit(circuit)
+
+    if compiled is None:
+        func = fitting.wrapCircuit(circuit, {})
+        residuals = lambda p: func(freq, *p) - measured
+        jac = '2-point'
+    else:
+        residuals = lambda p: _stack(compiled(p, freq)) - measured
+        jac = lambda p: _stack(compiled(p, freq, jacobian=True)[1], axis=-2)
+
+    with warnings.catch_warnings(), np.errstate(all='ignore'):
+        warnings.simplefilter('ignore')
+        result = optimize.least_squares(residuals, x0=guess, jac=jac,
+            method='lm', x_scale='jac', ftol=1e-13, max_nfev=100000)
+
+        dof = max(1, measured.size - result.x.size)
+        covariance = _covariance(result.jac, 2 * result.cost / dof)
+
+    n = len(freq)
+    predicted = result.fun + measured
+    parameters = result.x
+    return dict(
+        parameters = parameters,
+        conf = np.sqrt(np.abs(np.diag(covariance))),
+        covariance = covariance,
+        rmse = fitting.rmse(impedance, predicted[:n] + 1j*predicted[n:]),
+        nfev = result.nfev,
+        success = bool(result.success and np.isfinite(parameters).all() and (parameters > 0).all()),
+        )
+
+def _covariance(J, variance):
+    """Covariance of the parameters from the Jacobian at the solution, (J^T J)^-1 scaled by the residual variance. Works on stacks of Jacobians. The columns are normalised before inverting, otherwise parameters in ohms are lost to rounding next to parameters in farads."""
+    J = np.asarray(J)
+    A = np.einsum('...ki,...kj->...ij', J, J)
+    d = np.sqrt(np.diagonal(A, axis1=-2, axis2=-1))
+    d = np.where(d > 0, d, 1)
+    A = A / d[..., :, None] / d[..., None, :]
+
+    finite = np.isfinite(A).all(axis=(-2, -1))
+    covariance = np.full_like(A, np.nan)
+    with np.errstate(all='ignore'):
+        covariance[finite] = np.linalg.pinv(A[finite])
+        covariance = covariance / d[..., :, None] / d[..., None, :]
+    return covariance * np.asarray(variance)[..., None, None]
+
+def _stack(Z, axis=-1):
+    """Real and imaginary parts stacked along the frequency axis, as expected by the optimiser"""
+    return np.concatenate([Z.real, Z.imag], axis=axis)
+
+def fitted_model(circuit, parameters, conf=None, covariance=None):
+    """Builds a CustomCircuit from parameters that have already been fitted. The covariance, if known, is kept as covariance\_ and conf\_ derived from it."""
+    model = CustomCircuit(circuit=circuit, initial_guess=list(parameters), name='Custom circuit')
+    model.parameters_ = np.asarray(parameters)
+    if conf is None and covariance is not None:
+        conf = np.sqrt(np.abs(np.diag(covariance)))
+    model.conf_ = conf
+    model.covariance_ = covariance
+    return model
+
+def fit_sequential(freq, spectra, cutoff, circuit, guess, kelvin=None, runs=None, mode='previous', max_step=10, max_jump=100, progress=True):
+    """Fits every row of a spectrum matrix in order, starting each fit from the result of earlier ones rather than the same global guess. Neighbouring spectra differ only slightly in temperature so this takes far fewer iterations and is less likely to fall into a poor local minimum on cooling legs.
+
+    A fit has diverged if the optimiser fails or returns non-finite or negative parameters, if any parameter differs from the last converged fit by more than a factor of max_jump, or if its rmse is more than ten times that of the last converged fit. It is then repeated from the global guess, and only that fit is used as a seed later.
+
+    Args:
+        freq (array): frequencies of the spectra
+        spectra (np.ndarray): complex impedance, one row per measurement. Rows that are entirely nan are skipped.
+        cutoff (float): frequencies below this are ignored
+        circuit (str): circuit string
+        guess (list): global initial guess, used for the first spectrum and whenever a fit diverges
+        kelvin (array, optional): temperature of each row. Required by mode='interpolate'.
+        runs (array, optional): label of the temperature run each row belongs to. Interpolation only uses fits from the same run.
+        mode (str, optional): 'previous' starts from the last converged fit. 'interpolate' extrapolates the logarithm of the last two converged fits within the run linearly in 1/T, as expected for thermally activated elements. Defaults to 'previous'.
+        max_step (float, optional): an interpolated seed differs from the last converged fit by at most this factor. Fits less than about 0.1% apart in temperature are not extrapolated from. Defaults to 10.
+        max_jump (float, optional): see above. Defaults to 100.
+        progress (bool, optional): display a progress bar. Defaults to True.
+
+    Returns:
+        list: (model, resistance, rmse, nfev) for each row where nfev is the total number of function evaluations including any fallback. (nan, nan, nan, nan) for skipped rows.
+    """
+    if mode not in ['previous', 'interpolate']:
+        raise ValueError("mode must be either 'previous' or 'interpolate'")
+    if mode == 'interpolate' and kelvin is None:
+        raise ValueError("mode='interpolate' requires the temperature of each spectrum")
+
+    spectra = np.asarray(spectra)
+    freq = np.asarray(freq)
+    guess = np.asarray(guess, dtype=float)
+    if runs is None:
+        runs = np.zeros(len(spectra))
+
+    results = [(np.nan, np.nan, np.nan, np.nan)] * len(spectra)
+    previous, previous_rmse = None, None
+    history, current_run = [], None   # (1/T, log parameters) of converged fits in the current run
+    fallbacks = 0
+
+    def diverged(fit):
+        if not fit['success']:
+            return True
+        if previous is None:
+            return False
+        with np.errstate(all='ignore'):
+            jump = np.max(np.abs(np.log(fit['parameters'] / previous)))
+        return not jump <= np.log(max_jump) or fit['rmse'] > 10 * previous_rmse
+
+    rows = np.flatnonzero(np.isfinite(spectra).any(axis=1))
+    progress_bar = tqdm(rows, desc='Fitting spectra', disable=not progress)
+    for i in progress_bar:
+        if runs[i] != current_run:
+            history, current_run = [], runs[i]
+
+        seed = guess if previous is None else previous
+        if mode == 'interpolate' and len(history) >= 2:
+            (x0, p0), (x1, p1) = history[-2:]
+            # nearly equal temperatures would extrapolate wildly
+            if abs(x1 - x0) >= 1e-3 * abs(x1):
+                step = (p1 - p0) * (1/kelvin[i] - x1) / (x1 - x0)
+                seed = np.exp(p1 + np.clip(step, -np.log(max_step), np.log(max_step)))
+
+        measured = np.isfinite(spectra[i])
+        f, z = crop(freq[measured], spectra[i][measured], cutoff)
+        fit = fit_circuit(circuit, seed, f, z)
+        nfev = fit['nfev']
+
+        if seed is not guess and diverged(fit):
+            fallbacks += 1
+            fit = fit_circuit(circuit, guess, f, z)
+            nfev += fit['nfev']
+
+        if fit['success']:
+            previous, previous_rmse = fit['parameters'], fit['rmse']
+            if kelvin is not None:
+                history.append((1/kelvin[i], np.log(fit['parameters'])))
+
+        model = fitted_model(circuit, fit['parameters'], covariance=fit['covariance'])
+        results[i] = (model, get_resistance(model), fit['rmse'], nfev)
+        progress_bar.set_postfix(nfev=nfev, fallbacks=fallbacks)
+
+    return results
+
+def crop_mask(freq, spectra, cutoff):
+    """The points of each row of a spectrum matrix that :func:`crop` would keep (and that were measured) as a boolean matrix"""
+    spectra = np.asarray(spectra)
+    with np.errstate(invalid='ignore'):
+        return np.isfinite(spectra) & (np.asarray(freq) >= cutoff) & (spectra.imag < 0)
+
+def levenberg_marquardt(compiled, guess, freq, spectra, weights, ftol=1e-13, xtol=1e-12, max_iter=500, stall_tol=1e-8):
+    """Fits a compiled circuit to every row of a spectrum matrix at once. Each spectrum has its own parameters and damping but every iteration is a single vectorised pass: the Jacobians of all spectra are evaluated together and the damped normal equations solved with one batched call to :func:`numpy.linalg.solve`. Spectra that have converged are frozen and drop out of later iterations.
+
+    Steps are taken in the logarithm of the parameters, so every element stays positive and a step changes each parameter by a similar factor regardless of its units. The normal equations are also scaled by the diagonal of J^T J, as in Marquardt's original method, to keep them well conditioned.
+
+    Args:
+        compiled (CompiledCircuit): the circuit
+        guess (array): initial guess, either one for all spectra or one row per spectrum
+        freq (array): frequencies of the spectra
+        spectra (np.ndarray): complex impedance, one row per spectrum
+        weights (np.ndarray): weight of each point, 0 for cropped or missing points. See :func:`crop_mask`.
+        ftol (float, optional): converged when the relative reduction in cost is below ftol. Defaults to 1e-13.
+        xtol (float, optional): converged when the relative change in every parameter is below xtol. Defaults to 1e-12.
+        max_iter (int, optional): maximum number of iterations. Defaults to 500.
+        stall_tol (float, optional): a fit has stalled rather than converged if the impedance of any parameter is less sensitive than stall_tol times the most sensitive one, i.e. the parameter has run off towards zero or infinity. Defaults to 1e-8.
+
+    Returns:
+        dict: arrays of parameters, covariance, rmse, iterations and success with one entry per spectrum. Stalled fits are not successful.
+    """
+    freq = np.asarray(freq, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    spectra = np.where(weights > 0, spectra, 0)
+    n, n_par = len(spectra), len(compiled.names)
+    w = np.sqrt(np.concatenate([weights, weights], axis=-1))
+
+    def evaluate(q, rows):
+        # residuals and Jacobian with respect to q = log(parameters)
+        p = np.exp(q)
+        Z, J = compiled(p, freq, jacobian=True)
+        r = w[rows] * _stack(Z - spectra[rows])
+        return r, w[rows, :, None] * _stack(J * p[:, None, :], axis=-2)
+
+    with np.errstate(all='ignore'):
+        q = np.log(np.array(np.broadcast_to(guess, (n, n_par)), dtype=float))
+    lam = np.full(n, 1e-3)
+    iterations = np.zeros(n, dtype=int)
+    converged = np.zeros(n, dtype=bool)
+
+    with np.errstate(all='ignore'):
+        r, J = evaluate(q, np.arange(n))
+        cost = np.sum(r**2, axis=1)
+        failed = ~np.isfinite(cost)
+
+        for _ in range(max_iter):
+            active = np.flatnonzero(~converged & ~failed)
+            if not active.size:
+                break
+            Ja, ra = J[active], r[active]
+            A = np.einsum('nki,nkj->nij', Ja, Ja)
+            g = np.einsum('nki,nk->ni', Ja, ra)
+            d = np.sqrt(np.diagonal(A, axis1=1, axis2=2))
+            d = np.where(d > 0, d, 1)
+
+            # damped normal equations in parameters scaled to unit curvature
+            A = A / d[:, :, None] / d[:, None, :] + lam[active, None, None] * np.eye(n_par)
+            try:
+                step = -np.linalg.solve(A, (g / d)[..., None])[..., 0]
+            except np.linalg.LinAlgError:
+                step = -np.einsum('nij,nj->ni', np.linalg.pinv(A), g / d)
+            step = step / d
+            # change no parameter by more than a factor of e^2 in one iteration
+            step = step / np.maximum(1, np.max(np.abs(step), axis=1) / 2)[:, None]
+
+            trial = q[active] + step
+            r_trial, J_trial = evaluate(trial, active)
+            cost_trial = np.sum(r_trial**2, axis=1)
+            iterations[active] += 1
+
+            better = np.isfinite(cost_trial) & (cost_trial < cost[active])
+            accept = active[better]
+            reduction = (cost[accept] - cost_trial[better]) / np.where(cost[accept] > 0, cost[accept], 1)
+            small_step = np.all(np.abs(step[better]) <= xtol, axis=1)
+
+            q[accept], r[accept], J[accept], cost[accept] = trial[better], r_trial[better], J_trial[better], cost_trial[better]
+            lam[accept] = np.maximum(lam[accept] / 10, 1e-15)
+            converged[accept] = (reduction <= ftol) | small_step
+
+            reject = active[~better]
+            lam[reject] *= 10
+            # no step, however small, reduces the cost so this is a minimum
+            converged[reject] = lam[reject] > 1e+15
+
+        # a parameter driven towards zero or infinity stops affecting the spectrum, so the cost stops falling and the fit
+        # looks converged when it has stalled at the edge of the positive parameters (where fit_circuit would go negative)
+        influence = np.sqrt(np.sum(J**2, axis=1))
+        stalled = np.any(influence <= stall_tol * np.max(influence, axis=1, keepdims=True), axis=1)
+
+        p = np.exp(q)
+        J = J / p[:, None, :]
+        n_points = weights.sum(axis=1)
+        dof = np.maximum(1, 2 * n_points - n_par)
+        covariance = _covariance(J, cost / dof)
+        rmse = np.sqrt(cost / n_points)
+
+    return dict(
+        parameters = p,
+        covariance = covariance,
+        rmse = rmse,
+        iterations = iterations,
+        success = converged & ~stalled & np.isfinite(p).all(axis=1) & (p > 0).all(axis=1) & np.isfinite(cost),
+        )
+
+def fit_batch(freq, spectra, cutoff, circuit, guess, batch_size=1000, progress=True):
+    """Fits an equivalent circuit to every row of a spectrum matrix as one stacked least squares problem rather than one optimiser per spectrum. See :func:`levenberg_marquardt`. Only circuits supported by :class:`CompiledCircuit` can be fitted this way.
+
+    Args:
+        freq (array): frequencies of the spectra
+        spectra (np.ndarray): complex impedance, one row per measurement. Rows that are entirely nan are skipped.
+        cutoff (float): frequencies below this are ignored
+        circuit (str): circuit string
+        guess (list): initial guess of the circuit parameters
+        batch_size (int, optional): number of spectra fitted together, which bounds the memory used by the Jacobians. Defaults to 1000.
+        progress (bool, optional): display a progress bar. Defaults to True.
+
+    Returns:
+        list: (model, resistance, rmse) for each row, (nan, nan, nan) for skipped rows. Rows whose batched fit failed are refitted one at a time with :func:`fit_circuit`, and are (nan, nan, nan) if that fails too.
+    """
+    compiled = compile_circuit(circuit)
+    if compiled is None:
+        raise ValueError('{} cannot be fitted in batches, use fit_spectra instead'.format(circuit))
+
+    freq = np.asarray(freq, dtype=float)
+    spectra = np.asarray(spectra)
+    weights = crop_mask(freq, spectra, cutoff)
+    rows = np.flatnonzero(np.isfinite(spectra).any(axis=1))
+
+    results = [(np.nan, np.nan, np.nan)] * len(spectra)
+    progress_bar = tqdm(total=rows.size, desc='Fitting spectra', disable=not progress)
+    for start in range(0, rows.size, batch_size):
+        batch = rows[start:start+batch_size]
+        fit = levenberg_marquardt(compiled, guess, freq, spectra[batch], weights[batch])
+        for j, i in enumerate(batch):
+            parameters, covariance, rmse = fit['parameters'][j], fit['covariance'][j], fit['rmse'][j]
+            if not fit['success'][j]:
+                # refit on its own from the global guess, and leave it out if that fails too
+                measured = np.isfinite(spectra[i])
+                f, z = crop(freq[measured], spectra[i][measured], cutoff)
+                single = fit_circuit(circuit, guess, f, z)
+                if not single['success']:
+                    continue
+                parameters, covariance, rmse = single['parameters'], single['covariance'], single['rmse']
+            model = fitted_model(circuit, parameters, covariance=covariance)
+            results[i] = (model, get_resistance(model), rmse)
+        progress_bar.update(batch.size)
+    progress_bar.close()
+
+    return results
+
+class FitResult():
+    """The circuit fits of a whole experiment held as arrays, one row per spectrum, rather than one CustomCircuit per spectrum. Rows that were not fitted are nan. CustomCircuit objects are only built when asked for with :meth:`model`.
+
+    :Example:
+
+    >>> fits = FitResult.from_results('p(R1,C1)-p(R2,C2)', modelling.fit_spectra(...))
+    >>> fits.resistance
+    >>> fits.predict(freq, rows=[10, 11])
+    """
+    __slots__ = ('circuit', 'names', 'parameters', 'conf', 'rmse', '_models')
+
+    def __init__(self, circuit, parameters, conf=None, rmse=None):
+        self.circuit = circuit
+        self.parameters = np.atleast_2d(np.asarray(parameters, dtype=float))
+        self.names = CustomCircuit(circuit, initial_guess=[np.nan] * fitting.calculateCircuitLength(circuit)).get_param_names()[0]
+        self.conf = np.full_like(self.parameters, np.nan) if conf is None else np.asarray(conf, dtype=float)
+        self.rmse = np.full(len(self), np.nan) if rmse is None else np.asarray(rmse, dtype=float)
+        self._models = {}
+
+    def __repr__(self):
+        return 'FitResult({}, {} spectra)'.format(self.circuit, len(self))
+
+    def __len__(self):
+        return len(self.parameters)
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in self.__slots__ if k != '_models'}
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+        self._models = {}
+
+    @classmethod
+    def from_results(cls, circuit, results):
+        """Builds a FitResult from the (model, resistance, rmse, ...) tuples returned by :func:`fit_spectra` and friends"""
+        n_par = fitting.calculateCircuitLength(circuit)
+        parameters = np.full((len(results), n_par), np.nan)
+        conf = np.full((len(results), n_par), np.nan)
+        rmse = np.full(len(results), np.nan)
+        for i, result in enumerate(results):
+            model = result[0]
+            if isinstance(model, CustomCircuit):
+                parameters[i] = model.parameters_
+                if model.conf_ is not None:
+                    conf[i] = model.conf_
+                rmse[i] = result[2]
+        return cls(circuit, parameters, conf, rmse)
+
+    @property
+    def resistance(self):
+        """Sum of the resistors of each fit. Only meaningful for resistors in series, as with :func:`get_resistance`."""
+        columns = [i for i, name in enumerate(self.names) if name.startswith('R')]
+        resistance = self.parameters[:, columns].sum(axis=1)
+        resistance[~np.isfinite(self.parameters).all(axis=1)] = np.nan
+        return resistance
+
+    def model(self, row):
+        """The CustomCircuit of one row, built the first time it is asked for. None if the row was not fitted."""
+        if not np.isfinite(self.parameters[row]).all():
+            return None
+        if row not in self._models:
+            self._models[row] = fitted_model(self.circuit, self.parameters[row], self.conf[row])
+        return self._models[row]
+
+    def predict(self, freq, rows=None):
+        """The modelled impedance of all or selected rows at freq, evaluated together.
+
+        Returns:
+            np.ndarray: complex impedance with one row per fit
+        """
+        parameters = self.parameters if rows is None else self.parameters[rows]
+        compiled = compile_circuit(self.circuit)
+        if compiled is not None:
+            with np.errstate(invalid='ignore'):
+                return compiled(parameters, freq)
+
+        rows = np.arange(len(self)) if rows is None else np.arange(len(self))[rows]
+        predicted = np.full((rows.size, len(freq)), np.nan, dtype=complex)
+        for j, row in enumerate(np.atleast_1d(rows)):
+            model = self.model(row)
+            if model is not None:
+                predicted[j] = model.predict(np.asarray(freq))
+        return predicted
+
+def information_criteria(rmse, n_points, n_parameters):
+    """AIC and BIC of fits from their rmse, treating the real and imaginary parts of each point as separate observations.
+
+    Returns:
+        tuple: aic, bic
+    """
+    n = 2 * np.asarray(n_points, dtype=float)
+    with np.errstate(all='ignore'):
+        # sum of squared residuals over n observations is n_points * rmse^2
+        log_likelihood = n * np.log(np.asarray(rmse, dtype=float)**2 / 2)
+        return log_likelihood + 2 * n_parameters, log_likelihood + n_parameters * np.log(n)
+
+def select_circuit(freq, spectra, cutoff, circuits=None, criterion='bic', subset=50, keep=2, batch=True, workers=1, cache=True, progress=True):
+    """Fits several candidate circuits to every row of a spectrum matrix and picks the best for each row by AIC, BIC or rmse.
+
+    Candidates are first fitted to an evenly spaced subset of the spectra and only the best few by median score are fitted to all of them. Fits that did not succeed (see :func:`succeeded`) are not scored, so a candidate is never picked for a row it failed to fit.
+
+    Args:
+        circuits (dict, optional): circuit string: initial guess of each candidate. Defaults to config.CIRCUITS.
+        criterion (str, optional): 'aic', 'bic' or 'rmse', lower is better. Defaults to 'bic'.
+        subset (int, optional): number of spectra used to prune the candidates. Defaults to 50.
+        keep (int, optional): number of candidates fitted to every spectrum. Defaults to 2.
+        batch (bool, optional): fit compiled circuits with :func:`fit_batch`, otherwise and for other circuits use :func:`fit_spectra` with workers. Defaults to True.
+        workers (int, optional): processes used by fit_spectra. Defaults to 1.
+        cache (bool, optional): use the fit cache, see :func:`fit_cached`. Defaults to True.
+
+    Returns:
+        tuple: best circuit of each row (None for skipped rows), a pd.DataFrame of rmse, aic and bic with columns (circuit, score) for every candidate and row (nan where a candidate was pruned), and a dict of circuit: :class:`FitResult` of the candidates fitted to every row
+    """
+    if criterion not in ['aic', 'bic', 'rmse']:
+        raise ValueError("criterion must be one of 'aic', 'bic' or 'rmse'")
+    circuits = circuits or config.CIRCUITS
+    spectra = np.asarray(spectra)
+    n_points = crop_mask(freq, spectra, cutoff).sum(axis=1)
+    rows = np.flatnonzero(np.isfinite(spectra).any(axis=1))
+
+    def fit(circuit, selection):
+        if batch and compile_circuit(circuit) is not None:
+            fitter, kwargs = fit_batch, {}
+        else:
+            fitter, kwargs = fit_spectra, dict(workers=workers)
+        if cache:
+            fitter, kwargs = fit_cached, dict(fitter=fitter, **kwargs)
+        result = [(np.nan, np.nan, np.nan)] * len(spectra)
+        for i, r in zip(selection, fitter(freq, spectra[selection], cutoff, circuit, circuits[circuit], progress=False, **kwargs)):
+            # a failed fit can't be the best circuit for its row
+            if succeeded(r[0], r[2]):
+                result[i] = r
+        return FitResult.from_results(circuit, result)
+
+    def score(fits):
+        aic, bic = information_criteria(fits.rmse, n_points, fits.parameters.shape[1])
+        return pd.DataFrame(dict(rmse=fits.rmse, aic=aic, bic=bic))
+
+    candidates = list(circuits)
+    if len(candidates) > keep and rows.size > subset:
+        sample = np.unique(rows[np.linspace(0, rows.size - 1, subset).astype(int)])
+        # failed fits count as the worst score, so a candidate that only fits a few spectra isn't kept
+        median = {c: np.median(np.nan_to_num(score(fit(c, sample))[criterion].to_numpy()[sample], nan=np.inf))
+            for c in tqdm(candidates, desc='Pruning circuits', disable=not progress)}
+        candidates = sorted(candidates, key=lambda c: np.inf if np.isnan(median[c]) else median[c])[:keep]
+
+    fits, scores = {}, {}
+    for circuit in tqdm(candidates, desc='Fitting circuits', disable=not progress):
+        fits[circuit] = fit(circuit, rows)
+        scores[circuit] = score(fits[circuit])
+    for circuit in circuits:
+        if circuit not in scores:
+            scores[circuit] = pd.DataFrame(np.nan, index=range(len(spectra)), columns=['rmse', 'aic', 'bic'])
+    scores = pd.concat(scores, axis=1)[list(circuits)]
+
+    values = scores.xs(criterion, axis=1, level=1)[candidates].to_numpy()
+    best = np.full(len(spectra), None, dtype=object)
+    has_score = np.isfinite(values).any(axis=1)
+    best[has_score] = np.array(candidates, dtype=object)[np.nanargmin(values[has_score], axis=1)]
+    return best, scores, fits
+
+def lin_kk(freq, spectra, cutoff=0, c=None, max_elements=None, threshold=None, capacitance=None):
+    """Kramers-Kronig validity test (Schönleber et al. 2014, as :func:`impedance.validation.linKK`) of every row of a spectrum matrix at once. Spectra that don't satisfy the Kramers-Kronig relations, e.g. because the sample drifted during the sweep, can't be described by any equivalent circuit and are best left unfitted.
+
+    Each spectrum is fitted by a series resistance, inductance and (optionally) capacitance and M RC elements with fixed time constants, which is linear in the resistances. The frequencies are shared so the basis matrix is built once for each M and only the weights (1/\|Z\|) differ between spectra, which lets every spectrum be solved in one batched call. M is increased (from about two elements per decade of frequency) until the ratio of negative to positive resistance, mu, falls below c for each spectrum, and the best fit of the M tried is kept.
+
+    Args:
+        freq (array): frequencies of the spectra
+        spectra (np.ndarray): complex impedance, one row per measurement
+        cutoff (float, optional): frequencies below this are ignored. Defaults to 0.
+        c (float, optional): mu cutoff. Defaults to config.KRAMERS_KRONIG['c'].
+        max_elements (int, optional): maximum number of RC elements. Defaults to config.KRAMERS_KRONIG['max_elements'].
+        threshold (float, optional): a spectrum is valid if the rms of the relative residuals is below threshold. Defaults to config.KRAMERS_KRONIG['threshold'].
+        capacitance (bool, optional): include a series capacitance, as add_cap in linKK. It describes an arc whose low frequency end lies below the measured band, e.g. a resistive sample at low temperature, which the RC elements alone can't. Defaults to config.KRAMERS_KRONIG['capacitance'].
+
+    Returns:
+        dict: arrays of residual (rms relative residual), valid, n_elements and mu with one entry per row, and residuals_real and residuals_imag relative to \|Z\| at every point (nan where not used)
+    """
+    c = c or config.KRAMERS_KRONIG['c']
+    max_elements = max_elements or config.KRAMERS_KRONIG['max_elements']
+    threshold = threshold or config.KRAMERS_KRONIG['threshold']
+    capacitance = config.KRAMERS_KRONIG['capacitance'] if capacitance is None else capacitance
+    extra = 3 if capacitance else 2
+    freq = np.asarray(freq, dtype=float)
+    spectra = np.asarray(spectra)
+    with np.errstate(invalid='ignore'):
+        mask = np.isfinite(spectra) & (freq >= cutoff)
+    n = len(spectra)
+    z = np.where(mask, spectra, 0)
+    with np.errstate(divide='ignore'):
+        weight = np.where(mask, 1 / np.abs(z), 0)
+    W2 = np.concatenate([weight, weight], axis=1) ** 2
+    target = W2 * np.concatenate([z.real, z.imag], axis=1)
+
+    omega = 2 * np.pi * freq
+    used = omega[mask.any(axis=0)]
+    fit = np.full((n, freq.size), np.nan, dtype=complex)
+    n_elements = np.zeros(n, dtype=int)
+    mu = np.full(n, np.nan)
+    best = np.full(n, np.inf)
+    todo = mask.sum(axis=1) > 2
+    # mu is unreliable while the RC elements are sparser than about two per decade
+    min_elements = int(np.ceil(2 * np.log10(used.max() / used.min()))) if used.size else 1
+
+    for M in range(1, max_elements + 1):
+        rows = np.flatnonzero(todo)
+        if not rows.size or M + extra >= 2 * used.size:
+            break
+        tau = np.geomspace(1 / used.max(), 1 / used.min(), M) if M > 1 else np.array([1 / used.min()])
+        # columns: R0, one per RC element, L and 1/C
+        basis = np.hstack([
+            np.ones((freq.size, 1)),
+            1 / (1 + 1j * omega[:, None] * tau[None, :]),
+            1j * omega[:, None],
+            ] + ([-1j / omega[:, None]] if capacitance else []))
+        A = np.concatenate([basis.real, basis.imag], axis=0)
+        scale = np.linalg.norm(A, axis=0)
+        A = A / scale
+
+        # weighted normal equations A^T W^2 A x = A^T W^2 z of every spectrum
+        G = np.einsum('nk,ki,kj->nij', W2[rows], A, A)
+        G += 1e-12 * np.trace(G, axis1=1, axis2=2)[:, None, None] * np.eye(M + extra)
+        b = np.einsum('nk,ki->ni', target[rows], A)
+        x = np.linalg.solve(G, b[..., None])[..., 0] / scale
+
+        R = x[:, 1:M+1]
+        positive = np.where(R >= 0, R, 0).sum(axis=1)
+        with np.errstate(all='ignore'):
+            mu_M = 1 - np.abs(np.where(R < 0, R, 0).sum(axis=1)) / positive
+        done = ((mu_M <= c) & (M >= min_elements)) | (M == max_elements) | (M + extra + 1 >= 2 * used.size)
+
+        # the time constants move as M grows so the fit doesn't improve monotonically, keep the best so far
+        fit_M = x @ basis.T
+        error = (W2[rows, :freq.size] * np.abs(z[rows] - fit_M)**2).sum(axis=1)
+        better = error < best[rows]
+        keep = rows[better]
+        fit[keep] = fit_M[better]
+        mu[keep] = mu_M[better]
+        n_elements[keep] = M
+        best[keep] = error[better]
+        todo[rows[done]] = False
+
+    with np.errstate(all='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # rows without a spectrum
+        magnitude = np.where(mask, np.abs(spectra), np.nan)
+        residuals_real = (spectra.real - fit.real) / magnitude
+        residuals_imag = (spectra.imag - fit.imag) / magnitude
+        residual = np.sqrt(np.nanmean(residuals_real**2 + residuals_imag**2, axis=1))
+
+    return dict(
+        residual = residual,
+        valid = residual < threshold,
+        n_elements = n_elements,
+        mu = mu,
+        residuals_real = residuals_real,
+        residuals_imag = residuals_imag,
+        )
+
+class DRTKernel():
+    """The distribution of relaxation times (DRT) kernel for one set of frequencies, with its singular value decomposition and the factorisations of the regularised normal equations. Every spectrum measured at the same frequencies shares them.
+
+    Z(w) = R_inf + sum_j gamma_j dln(tau) / (1 + i w tau_j), with the real and imaginary parts of the kernel stacked row-wise and R_inf in the first column.
+    """
+
+    def __init__(self, freq, tau):
+        omega = 2 * np.pi * np.asarray(freq, dtype=float)
+        K = np.log(tau[1] / tau[0]) / (1 + 1j * omega[:, None] * tau[None, :])
+        self.A = np.block([
+            [np.ones((omega.size, 1)), K.real],
+            [np.zeros((omega.size, 1)), K.imag],
+            ])
+        self.gram = self.A.T @ self.A
+        self.U, self.s, _ = np.linalg.svd(self.A, full_matrices=False)
+        self._factors = {}
+
+    def gcv(self, b, lambdas):
+        """The regularisation parameter from lambdas that minimises the generalised cross validation function of each row of b, from the SVD so that every candidate costs one multiplication"""
+        c = b @ self.U
+        outside = np.sum(b**2, axis=1) - np.sum(c**2, axis=1)
+        filters = self.s**2 / (self.s**2 + np.asarray(lambdas)[:, None])  # (lambdas, singular values)
+        residual = np.einsum('ls,ns->nl', (1 - filters)**2, c**2) + outside[:, None]
+        dof = self.A.shape[0] - filters.sum(axis=1)
+        return np.asarray(lambdas)[np.argmin(residual / dof**2, axis=1)]
+
+    def factor(self, lam):
+        """Upper triangular R with R^T R = A^T A + lam I, except that R_inf isn't regularised"""
+        if lam not in self._factors:
+            penalty = np.full(self.A.shape[1], lam)
+            penalty[0] = 0
+            self._factors[lam] = linalg.cholesky(self.gram + np.diag(penalty))
+        return self._factors[lam]
+
+    def solve(self, b, lam):
+        """Non-negative solution of min \|A x - b\|^2 + lam \|x\|^2 for every row of b.
+
+        Expanding the objective, it equals \|R x - d\|^2 plus a constant where R is the factor of the regularised normal equations and R^T d = A^T b. R is shared, so d for every spectrum comes from one triangular solve, leaving a small square NNLS problem per spectrum.
+        """
+        R = self.factor(lam)
+        d = linalg.solve_triangular(R, (b @ self.A).T, trans='T').T
+        return np.array([optimize.nnls(R, row)[0] for row in d]).reshape(len(b), -1)
+
+_DRT_KERNELS = {}
+
+def _drt_kernel(freq, tau):
+    key = (np.asarray(freq, dtype=float).tobytes(), tau.tobytes())
+    if key not in _DRT_KERNELS:
+        _DRT_KERNELS[key] = DRTKernel(freq, tau)
+    return _DRT_KERNELS[key]
+
+def drt(freq, spectra, cutoff=0, n_tau=None, lam=None, progress=True):
+    """Distribution of relaxation times of every row of a spectrum matrix by Tikhonov regularised non-negative least squares.
+
+    Spectra are normalised by their largest \|Z\| so that all those measured at the same frequencies share one kernel (see :class:`DRTKernel`, cached for the life of the session). Rows are grouped by which frequencies were measured, so partial sweeps get their own kernel. The regularisation parameter of each spectrum is chosen from config.DRT['lambda_range'] by generalised cross validation, unless given, and each parameter needs only one factorisation for every spectrum that uses it.
+
+    Args:
+        freq (array): frequencies of the spectra
+        spectra (np.ndarray): complex impedance, one row per measurement
+        cutoff (float, optional): frequencies below this are ignored. Defaults to 0.
+        n_tau (int, optional): number of relaxation times. Defaults to config.DRT['n_tau'].
+        lam (float, optional): regularisation parameter of the normalised problem. Defaults to choosing one per spectrum.
+        progress (bool, optional): display a progress bar. Defaults to True.
+
+    Returns:
+        dict: tau (s), gamma (ohm per unit ln(tau), one row per spectrum), r_inf and r_polarisation (ohm), lam and rmse (ohm). Rows without a spectrum are nan.
+    """
+    freq = np.asarray(freq, dtype=float)
+    spectra = np.asarray(spectra)
+    n_tau = n_tau or config.DRT['n_tau']
+    with np.errstate(invalid='ignore'):
+        mask = np.isfinite(spectra) & (freq >= cutoff)
+
+    # one decade beyond the measured frequencies at either end
+    used = freq[mask.any(axis=0)] if mask.any() else freq
+    tau = np.geomspace(0.1 / (2 * np.pi * used.max()), 10 / (2 * np.pi * used.min()), n_tau)
+    dln_tau = np.log(tau[1] / tau[0])
+    candidates = np.logspace(*config.DRT['lambda_range'], config.DRT['n_lambda'])
+
+    n = len(spectra)
+    x = np.full((n, n_tau + 1), np.nan)
+    lambdas = np.full(n, np.nan)
+    rmse = np.full(n, np.nan)
+
+    patterns, group = np.unique(mask, axis=0, return_inverse=True)
+    group = group.ravel()
+    progress_bar = tqdm(total=int((mask.sum(axis=1) > 2).sum()), desc='DRT', disable=not progress)
+    for k, pattern in enumerate(patterns):
+        rows = np.flatnonzero(group == k)
+        if pattern.sum() <= 2:
+            continue
+        kernel = _drt_kernel(freq[pattern], tau)
+        z = spectra[rows][:, pattern]
+        scale = np.abs(z).max(axis=1, keepdims=True)
+        b = np.concatenate([z.real, z.imag], axis=1) / scale
+
+        lam_k = kernel.gcv(b, candidates) if lam is None else np.full(rows.size, float(lam))
+        xk = np.zeros((rows.size, n_tau + 1))
+        for value in np.unique(lam_k):
+            same = lam_k == value
+            xk[same] = kernel.solve(b[same], value)
+            progress_bar.update(same.sum())
+
+        x[rows] = xk * scale
+        lambdas[rows] = lam_k
+        residual = (xk @ kernel.A.T - b) * scale
+        rmse[rows] = np.sqrt(np.sum(residual**2, axis=1) / pattern.sum())
+    progress_bar.close()
+
+    gamma = x[:, 1:]
+    return dict(
+        tau = tau,
+        gamma = gamma,
+        r_inf = x[:, 0],
+        r_polarisation = gamma.sum(axis=1) * dln_tau,
+        lam = lambdas,
+        rmse = rmse,
+        )
+
+def estimate_resistance(freq, spectra, cutoff):
+    """Estimates resistance from every row of a spectrum matrix at once without fitting a circuit. Much faster than a full fit and good enough for live monitoring.
+
+    Three estimates are made from the points kept by :func:`crop`:
+
+        * circle - the low frequency real axis intercept of a circle fitted algebraically (Kasa's method) to the lowest frequency arc of the Cole-Cole plot, i.e. the points below the first minimum of -Im(Z) after its first peak
+        * intercept - the real axis intercept of a straight line through the two lowest frequency points
+        * peak - Re(Z) + -Im(Z) at the maximum of -Im(Z), the low frequency intercept of an ideal RC arc
+
+    The capacitance of the arc with the highest peak is 1 / (2 pi f R) where f is the frequency of the peak and R twice its height.
+
+    Returns:
+        dict: arrays of circle, intercept and peak resistance, peak_frequency and capacitance with one entry per row. Circle and intercept estimates that are not positive are nan.
+    """
+    freq = np.asarray(freq, dtype=float)
+    order = np.argsort(freq)
+    freq = freq[order]
+    spectra = np.asarray(spectra)[:, order]
+    mask = crop_mask(freq, spectra, cutoff)
+    count = mask.sum(axis=1)
+    rows = np.arange(len(spectra))
+
+    with np.errstate(all='ignore'):
+        minus_im = np.where(mask, -spectra.imag, np.nan)
+
+        # the lowest frequency arc ends where -Im(Z) first starts rising again with increasing frequency after passing
+        # the peak of the arc, if the peak was measured
+        change = np.diff(np.where(mask, minus_im, -np.inf), axis=1)
+        measured = mask[:, 1:] & (np.cumsum(mask, axis=1)[:, :-1] > 0)
+        falling = (change < 0) & measured
+        rising = (change > 0) & measured & (np.cumsum(falling, axis=1) > 0)
+        valley = np.where(rising.any(axis=1), np.argmax(rising, axis=1), freq.size - 1)
+        arc = mask & (np.arange(freq.size) <= valley[:, None])
+        arc[arc.sum(axis=1) < 3] = mask[arc.sum(axis=1) < 3]
+        w = arc.astype(float)
+
+        # circle fit in units of the largest impedance of each spectrum to keep the sums well scaled
+        scale = np.max(np.where(mask, np.abs(spectra), 0), axis=1, keepdims=True)
+        x = np.where(arc, spectra.real / scale, 0)
+        y = np.where(arc, -spectra.imag / scale, 0)
+        basis = np.stack([x, y, np.ones_like(x)], axis=-1) * w[..., None]
+        M = np.einsum('nki,nkj->nij', basis, basis)
+        rhs = -np.einsum('nki,nk->ni', basis, x**2 + y**2)
+        coefficients = np.einsum('nij,nj->ni', np.linalg.pinv(M), rhs)
+        coefficients[w.sum(axis=1) < 3] = np.nan
+        D, E, F = coefficients.T
+        a = -D / 2
+        # x where the circle crosses y = 0: (x - a)^2 + b^2 = r^2 with r^2 = a^2 + b^2 - F
+        circle = (a + np.sqrt(a**2 - F)) * scale[:, 0]
+
+        # straight line through the two lowest frequency points
+        n_kept = np.cumsum(mask, axis=1)
+        z1 = spectra[rows, np.argmax(n_kept == 1, axis=1)]
+        z2 = spectra[rows, np.argmax(n_kept == 2, axis=1)]
+        intercept = z1.real - z1.imag * (z2.real - z1.real) / (z2.imag - z1.imag)
+        intercept[count < 2] = np.nan
+
+        # an ideal RC arc peaks at R/2 above its centre, R0 + R/2
+        k = np.argmax(np.where(mask, minus_im, -np.inf), axis=1)
+        peak = spectra[rows, k].real + minus_im[rows, k]
+        peak_frequency = freq[k]
+        peak[count < 1] = np.nan
+        peak_frequency[count < 1] = np.nan
+        # R = 2 h for a semicircle of height h
+        capacitance = 1 / (2 * np.pi * peak_frequency * 2 * minus_im[rows, k])
+
+        # a circle or line that crosses the real axis at or below zero is a failed estimate
+        circle[~(circle > 0)] = np.nan
+        intercept[~(intercept > 0)] = np.nan
+
+    return dict(
+        circle = circle,
+        intercept = intercept,
+        peak = peak,
+        peak_frequency = peak_frequency,
+        capacitance = capacitance,
+        )
+
+def agreement(estimates, resistance):
+    """Compares resistance estimates with the resistance from full circuit fits.
+
+    Args:
+        estimates (dict): arrays of estimated resistance, e.g. from :func:`estimate_resistance`. Entries that aren't resistances are ignored.
+        resistance (array): resistance from circuit fits
+
+    Returns:
+        pd.DataFrame: for each estimate, the number of rows compared (n), median relative error (bias), median absolute log10 ratio (mad_log10), fraction within 10 percent and correlation of log10 resistance
+    """
+    resistance = np.asarray(resistance, dtype=float)
+    result = {}
+    for name in ['circle', 'intercept', 'peak']:
+        if name not in estimates:
+            continue
+        estimate = np.asarray(estimates[name], dtype=float)
+        with np.errstate(all='ignore'):
+            ok = np.isfinite(estimate) & np.isfinite(resistance) & (estimate > 0) & (resistance > 0)
+            log_ratio = np.log10(estimate[ok] / resistance[ok])
+            result[name] = dict(
+                n = int(ok.sum()),
+                bias = np.median(10**log_ratio - 1) if ok.any() else np.nan,
+                mad_log10 = np.median(np.abs(log_ratio)) if ok.any() else np.nan,
+                within_10 = np.mean(np.abs(10**log_ratio - 1) <= 0.1) if ok.any() else np.nan,
+                correlation = np.corrcoef(np.log10(estimate[ok]), np.log10(resistance[ok]))[0, 1] if ok.sum() > 1 else np.nan,
+                )
+    return pd.DataFrame(result).T
+
+# state held by each worker process of fit_spectra
+_worker = {}
+
+def _init_worker(spectra, freq, kwargs):
+    """Runs once in each worker process. spectra is either the array itself or the (name, shape, dtype) of the shared memory block holding it."""
+    if isinstance(spectra, tuple):
+        name, shape, dtype = spectra
+        _worker['shm'] = shared_memory.SharedMemory(name=name)
+        spectra = np.ndarray(shape, dtype=dtype, buffer=_worker['shm'].buf)
+    _worker.update(spectra=spectra, freq=np.asarray(freq), kwargs=kwargs)
+
+def _fit_rows(rows):
+    freq, kwargs = _worker['freq'], _worker['kwargs']
+    result = []
+    for i in rows:
+        z = _worker['spectra'][i]
+        measured = np.isfinite(z)  # partial sweeps are padded with nan
+        result.append(model_conductivity(freq[measured], z[measured], **kwargs))
+    return result
+
+def fit_spectra(freq, spectra, cutoff, circuit, guess, workers=1, chunksize=None, progress=True):
+    """Fits an equivalent circuit to every row of a spectrum matrix using a pool of worker processes. The spectra are placed in shared memory so that each worker reads them directly rather than receiving a copy with every chunk of work. Results are returned in row order regardless of the order in which the chunks finish.
+
+    Args:
+        freq (array): frequencies of the spectra
+        spectra (np.ndarray): complex impedance, one row per measurement. Rows that are entirely nan are skipped.
+        cutoff (float): frequencies below this are ignored
+        circuit (str): circuit string passed to :class:`impedance.models.circuits.CustomCircuit`
+        guess (list): initial guess of the circuit parameters
+        workers (int, optional): number of processes. 1 fits in the current process, None uses every core. Defaults to 1.
+        chunksize (int, optional): number of spectra sent to a worker at a time. Defaults to a quarter of an even share.
+        progress (bool, optional): display a progress bar. Defaults to True.
+
+    Returns:
+        list: (model, resistance, rmse) for each row, (nan, nan, nan) for skipped rows
+    """
+    spectra = np.asarray(spectra)
+    workers = workers or os.cpu_count()
+    kwargs = dict(cutoff=cutoff, circuit=circuit, guess=guess)
+
+    rows = np.flatnonzero(np.isfinite(spectra).any(axis=1))
+    if chunksize is None:
+        chunksize = max(1, int(np.ceil(rows.size / (4 * workers))))
+    chunks = [rows[i:i+chunksize] for i in range(0, rows.size, chunksize)]
+
+    results = [(np.nan, np.nan, np.nan)] * len(spectra)
+    progress_bar = tqdm(total=rows.size, desc='Fitting spectra', disable=not progress)
+
+    if workers == 1:
+        _init_worker(spectra, freq, kwargs)
+        try:
+            for chunk in chunks:
+                for i, result in zip(chunk, _fit_rows(chunk)):
+                    results[i] = result
+                progress_bar.update(chunk.size)
+        finally:
+            _worker.clear()
+            progress_bar.close()
+        return results
+
+    shm = None
+    if shared_memory is not None:
+        shm = shared_memory.SharedMemory(create=True, size=max(1, spectra.nbytes))
+        np.ndarray(spectra.shape, dtype=spectra.dtype, buffer=shm.buf)[:] = spectra
+        initargs = ((shm.name, spectra.shape, spectra.dtype.str), freq, kwargs)
+    else:
+        initargs = (spectra, freq, kwargs)
+
+    try:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as pool:
+            futures = {pool.submit(_fit_rows, chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                chunk = futures[future]
+                for i, result in zip(chunk, future.result()):
+                    results[i] = result
+                progress_bar.update(chunk.size)
+    finally:
+        progress_bar.close()
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    return results
+
+# increment whenever a change to the fitting routines would change their results, invalidating cached fits
+FITTER_VERSION = 2
+
+class FitCache():
+    """An on-disk cache of circuit fits, addressed by the content of what was fitted: the spectrum, frequencies, circuit, initial guess, cutoff and fitting routine. Reprocessing an experiment only fits the spectra that have not been fitted before with the same settings.
+
+    Fits are stored in an SQLite database as their parameters, covariance and rmse. Once the cache holds more than max_entries the least recently used fits are discarded.
+
+    :Example:
+
+    >>> cache = FitCache()
+    >>> key = cache.key(freq, spectrum, circuit, guess, cutoff)
+    >>> cache.get([key])
+    """
+
+    def __init__(self, path=None, max_entries=None):
+        self.path = path or os.path.join(config.CACHE_DIR, 'fits.sqlite')
+        self.max_entries = max_entries or config.FIT_CACHE_SIZE
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with _connection(self.path) as db:
+            db.execute('CREATE TABLE IF NOT EXISTS fits ('
+                'key TEXT PRIMARY KEY, parameters BLOB, covariance BLOB, rmse REAL, accessed REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS fits_accessed ON fits (accessed)')
+
+    def __repr__(self):
+        return 'FitCache({}, {} fits, {} hits, {} misses)'.format(self.path, len(self), self.hits, self.misses)
+
+    def __len__(self):
+        with _connection(self.path) as db:
+            return db.execute('SELECT COUNT(*) FROM fits').fetchone()[0]
+
+    @staticmethod
+    def key(freq, spectrum, circuit, guess, cutoff, fitter='fit_spectra'):
+        """The key of a fit: a hash of everything that determines its result"""
+        digest = hashlib.sha1()
+        digest.update(np.ascontiguousarray(spectrum, dtype=complex).tobytes())
+        digest.update(np.ascontiguousarray(freq, dtype=float).tobytes())
+        digest.update(np.ascontiguousarray(guess, dtype=float).tobytes())
+        digest.update(repr((circuit, float(cutoff), fitter, FITTER_VERSION)).encode())
+        return digest.hexdigest()
+
+    def get(self, keys):
+        """Looks up fits by key.
+
+        Returns:
+            dict: (parameters, covariance, rmse) for each key that was found
+        """
+        found = {}
+        with _connection(self.path) as db:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start+500]
+                rows = db.execute('SELECT key, parameters, covariance, rmse FROM fits WHERE key IN ({})'.format(
+                    ','.join('?' * len(chunk))), chunk).fetchall()
+                for key, parameters, covariance, rmse in rows:
+                    parameters = np.frombuffer(parameters)
+                    covariance = np.frombuffer(covariance).reshape(parameters.size, parameters.size)
+                    found[key] = (parameters, covariance, rmse)
+            db.executemany('UPDATE fits SET accessed = ? WHERE key = ?',
+                [(time.time(), key) for key in found])
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, fits):
+        """Stores fits given as a dict of key: (parameters, covariance, rmse), then discards the least recently used fits beyond max_entries"""
+        now = time.time()
+        with _connection(self.path) as db:
+            db.executemany('INSERT OR REPLACE INTO fits VALUES (?, ?, ?, ?, ?)', [
+                (key, np.asarray(p, dtype=float).tobytes(), np.asarray(c, dtype=float).tobytes(), float(rmse), now)
+                for key, (p, c, rmse) in fits.items()])
+            excess = db.execute('SELECT COUNT(*) FROM fits').fetchone()[0] - self.max_entries
+            if excess > 0:
+                db.execute('DELETE FROM fits WHERE key IN (SELECT key FROM fits ORDER BY accessed LIMIT ?)', (excess,))
+
+    def clear(self):
+        """Removes every fit and resets the hit and miss counters"""
+        with _connection(self.path) as db:
+            db.execute('DELETE FROM fits')
+        self.hits = self.misses = 0
+
+
+@contextmanager
+def _connection(path):
+    """Opens an SQLite connection that commits on success and is always closed"""
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+_FIT_CACHES = {}
+
+def fit_cache(path=None):
+    """Returns the shared :class:`FitCache` at path, which defaults to fits.sqlite in config.CACHE_DIR"""
+    path = path or os.path.join(config.CACHE_DIR, 'fits.sqlite')
+    if path not in _FIT_CACHES:
+        _FIT_CACHES[path] = FitCache(path)
+    return _FIT_CACHES[path]
+
+def succeeded(model, rmse):
+    """Whether a fit returned by one of the fitting functions is usable: a fitted model with finite, positive parameters and a finite rmse"""
+    parameters = getattr(model, 'parameters_', None)
+    if parameters is None:
+        return False
+    parameters = np.asarray(parameters, dtype=float)
+    return bool(np.isfinite(rmse) and np.isfinite(parameters).all() and (parameters > 0).all())
+
+def fit_cached(freq, spectra, cutoff, circuit, guess, fitter=None, cache=None, **kwargs):
+    """Fits every row of a spectrum matrix like fitter, but only the rows that are not already in the cache. New fits are added to the cache.
+
+    Args:
+        fitter (function, optional): :func:`fit_spectra` or :func:`fit_batch`. Defaults to fit_spectra.
+        cache (FitCache, optional): Defaults to :func:`fit_cache`.
+        kwargs: passed on to fitter
+
+    Returns:
+        list: (model, resistance, rmse) for each row, (nan, nan, nan) for skipped rows. Fits that did not succeed (see :func:`succeeded`) are returned but not cached.
+    """
+    fitter = fitter or fit_spectra
+    if cache is None:
+        cache = fit_cache()
+    spectra = np.asarray(spectra)
+
+    rows = np.flatnonzero(np.isfinite(spectra).any(axis=1))
+    keys = [cache.key(freq, spectra[i], circuit, guess, cutoff, fitter.__name__) for i in rows]
+    found = cache.get(keys)
+
+    results = [(np.nan, np.nan, np.nan)] * len(spectra)
+    for i, key in zip(rows, keys):
+        if key in found:
+            parameters, covariance, rmse = found[key]
+            model = fitted_model(circuit, parameters, covariance=covariance)
+            results[i] = (model, get_resistance(model), rmse)
+
+    missing = [(i, key) for i, key in zip(rows, keys) if key not in found]
+    if missing:
+        fits = fitter(freq, spectra[[i for i, _ in missing]], cutoff, circuit, guess, **kwargs)
+        new = {}
+        for (i, key), (model, resistance, rmse) in zip(missing, fits):
+            results[i] = (model, resistance, rmse)
+            if not succeeded(model, rmse):
+                # not cached, so it is fitted again next time rather than served forever
+                continue
+            covariance = getattr(model, 'covariance_', None)
+            if covariance is None:
+                covariance = np.diag(np.asarray(model.conf_, dtype=float) ** 2)
+            new[key] = (model.parameters_, covariance, rmse)
+        cache.put(new)
+
+    return results
+
+def _background_fit(tasks, results, freq, circuit, guess, cutoff):
+    """Runs in the process started by :class:`BackgroundFitter`. Each fit starts from the previous converged fit as neighbouring measurements are similar, see :func:`fit_sequential`."""
+    freq = np.asarray(freq, dtype=float)
+    guess = np.asarray(guess, dtype=float)
+    previous = None
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        key, spectrum = task
+        try:
+            f, z = crop(freq, np.asarray(spectrum), cutoff)
+            fit = fit_circuit(circuit, guess if previous is None else previous, f, z)
+            if not fit['success'] and previous is not None:
+                fit = fit_circuit(circuit, guess, f, z)
+            if fit['success']:
+                previous = fit['parameters']
+            model = fitted_model(circuit, fit['parameters'], covariance=fit['covariance'])
+            results.put((key, dict(
+                resistance = get_resistance(model) if fit['success'] else np.nan,
+                model_rmse = fit['rmse'],
+                parameters = fit['parameters'],
+                )))
+        except Exception as e:
+            results.put((key, dict(resistance=np.nan, model_rmse=np.nan, error=str(e))))
+
+class BackgroundFitter():
+    """Fits impedance spectra in a separate process while measurements continue. Spectra are submitted as soon as they are measured and fits are collected whenever convenient, so the measurement loop never waits for the optimiser.
+
+    :Example:
+
+    >>> fitter = BackgroundFitter(freq)
+    >>> fitter.submit(measurement['time'], spectrum)
+    >>> fitter.collect()
+    {Timestamp(...): {'resistance': ..., 'model_rmse': ..., 'parameters': ...}}
+    >>> fitter.close()
+    """
+
+    def __init__(self, freq, circuit=None, guess=None, cutoff=None):
+        """
+        Args:
+            freq (array): frequencies of the spectra
+            circuit (str, optional): circuit string. Defaults to config.LIVE_FIT['circuit'].
+            guess (list, optional): initial guess. Defaults to config.LIVE_FIT['guess'].
+            cutoff (float, optional): frequencies below this are ignored. Defaults to config.LIVE_FIT['cutoff'].
+        """
+        self.circuit = circuit or config.LIVE_FIT['circuit']
+        self.results = {}
+        self.pending = 0
+        context = multiprocessing.get_context('spawn')
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._process = context.Process(
+            target = _background_fit,
+            args = (self._tasks, self._results, list(freq), self.circuit,
+                guess or config.LIVE_FIT['guess'],
+                config.LIVE_FIT['cutoff'] if cutoff is None else cutoff),
+            daemon = True,
+            )
+        self._process.start()
+
+    def submit(self, key, spectrum):
+        """Queues a spectrum (complex impedance at every frequency) to be fitted. key identifies the fit in :attr:`results`, e.g. the time of the measurement."""
+        self._tasks.put((key, np.asarray(spectrum, dtype=complex)))
+        self.pending += 1
+
+    def collect(self, timeout=0):
+        """Returns the fits that have finished since the last call, as a dict of key: result, and adds them to :attr:`results`. Waits up to timeout seconds for each one if there are fits still pending."""
+        new = {}
+        while self.pending:
+            try:
+                key, result = self._results.get(timeout=timeout) if timeout else self._results.get_nowait()
+            except queue.Empty:
+                break
+            new[key] = result
+            self.pending -= 1
+        self.results.update(new)
+        return new
+
+    def close(self, timeout=60):
+        """Waits up to timeout seconds for pending fits, then stops the worker process. Returns the fits collected while waiting."""
+        new = self.collect(timeout=timeout)
+        self._tasks.put(None)
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.terminate()
+        return new
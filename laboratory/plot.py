@@ -48,16 +48,23 @@ def plot(func):
     return wrapper
 
 def thermopower_only(data):
-    return data[data.z.isnull()]
+    return data[data.complex_z.isnull()]
 
 def conductivity_only(data):
-    return data[data.z.notnull()]
+    return data[data.complex_z.notnull()]
 
 def index_temp(T, Tx):
     # returns the index of T nearest to the specified temp Tx. For use in colecole plots
     index = np.abs(T - Tx).argmin()
     return [index, T.to_numpy().flat[index]]
 
+def index_data(data, step=None, time=[]):
+    """Rows of data from step (if given) measured between time[0] and time[1]. Either time can be None for an open window. data can be a Sample or a processed dataframe. See :meth:`processing.Sample.window`."""
+    start, end = (list(time) + [None, None])[:2]
+    if isinstance(data, Sample):
+        return data.window(start, end, step=step)[0]
+    return processing.time_window(data, start, end, step)
+
 def voltage(data, step=None, bars=False, time=[], kwargs={}):
     """Plots voltage versus time"""
     data = index_data(data,step,time)
@@ -116,8 +123,7 @@ def conductivity(data, temp_list=None, ax=None, fmt='o'):
     resistance = []
     temp_out = []
     if temp_list:
-        for temp in temp_list:
-            [index, _] = index_temp(data.temp,temp)
+        for index in processing.TemperatureIndex(data).nearest(temp_list):
             row = data.iloc[index]
             resistance.append(calculate(row))
             temp_out.append(row.kelvin)
@@ -157,15 +163,22 @@ def temperature(data, ax=None, **kwargs):
 
 # BASE LEVEL PLOTS
 @plot
-def cole(data, freq, temp, freq_min=200, freq_max=None, fit=False, ax=None, **kwargs):
+def cole(data, freq, temp, freq_min=200, freq_max=None, fit=False, fits=None, ax=None, row=None, **kwargs):
     """Creates a Cole-Cole plot (imaginary versus real impedance) at a given temperature. Finds the available data closest to the temperature specified by 'temp'. A linear least squares circle fit can be added by setting fit=True.
 
     :param temp: temperature in degrees C
     :type temp: float/int
+
+    :param fits: the fitted circuits of the sample (Sample.fits), indexed by the index of data. Required when fit=True.
+    :type fits: modelling.FitResult
+
+    :param row: position in data of the spectrum to plot, e.g. from Sample.nearest_temp. Defaults to the measurement closest to temp.
+    :type row: int
     """
-    data = conductivity_only(data)
-    # for temp in temp_list:
-    [index, Tval] = index_temp(data.temp,temp)
+    if row is None:
+        data = conductivity_only(data)
+        [row, Tval] = index_temp(data.temp,temp)
+    index = row
     f, z = pp.cropFrequencies(
         frequencies=np.array(freq), 
         Z=data.complex_z.iloc[index], 
@@ -175,10 +188,9 @@ def cole(data, freq, temp, freq_min=200, freq_max=None, fit=False, ax=None, **kw
     p = ax.scatter(np.real(z)/1000, np.abs(np.imag(z))/1000,**kwargs)
 
     if fit:
-        model = data.model.iloc[index]
-        predicted = model.predict(np.geomspace(0.001,2000000,100))      
+        predicted = fits.predict(np.geomspace(0.001,2000000,100), rows=[data.index[index]])[0]
         ax.plot(np.real(predicted)/1000, np.abs(np.imag(predicted))/1000) 
-        ax.add_artist(AnchoredText(model.circuit, loc=2))
+        ax.add_artist(AnchoredText(fits.circuit, loc=2))
 
 
     if not ax.xaxis.get_label().get_text():
@@ -241,23 +253,13 @@ def thermopower_vs_fugacity(sample, ax=None, **kwargs):
     else:
         fig = ax.get_figure()
 
-    data = sample.thermopower
-    data = data[data.hold_length == 0]
-    steps = data.step.unique()
-
-    thermopower, fugacity, temp = [], [], []
-    for step in steps:
-        tmp = data.loc[data.step == step]
-        result = sm.WLS(tmp.voltage, sm.add_constant(tmp.gradient), weights=1./(tmp.volt_stderr ** 2)).fit()
-        slope = result.params['gradient']
-        thermopower.append(-slope)
-        fugacity.append(tmp.actual_fugacity.mean())
-        temp.append(tmp.temp.mean())
+    table = processing.thermopower_table(sample)
+    table = table[table.hold_length == 0]
 
     p = ax.scatter(
-        fugacity, 
-        thermopower,
-        c=temp)
+        table.actual_fugacity, 
+        table.thermopower,
+        c=table.temp)
 
     ax.set_xscale('log')
     cb = fig.colorbar(p, ax=ax)
@@ -283,24 +285,11 @@ def diffusion(data, ax=None,**kwargs):
 
 @plot
 def thermopower(data, ax=None,**kwargs):
-    data = thermopower_only(data)
-    steps = data.step.unique()
-    colors = ['r','b','g','c','m','y','k']
-    data['gradient'] = data.thermo_1 - data.thermo_2
-
-    thermopower = []
-    fugacity = []
-    for step, c in zip(steps,color_cycle):
-        tmp = data.loc[data.step == step]
-        result = sm.WLS(tmp.voltage, sm.add_constant(tmp.gradient), weights=1./(tmp.volt_stderr ** 2)).fit()
-        slope = result.params['gradient']
-        thermopower.append(-slope)
-        fugacity.append(tmp.actual_fugacity.mean())
-        # ax = voltage_vs_gradient(tmp, ax=ax, **c)
-    ax.plot(fugacity, thermopower,'rx')
+    table = processing.thermopower_table(data)
+    ax.plot(table.actual_fugacity, table.thermopower,'rx')
     ax.set_xscale('log')
 
-    return thermopower
+    return table.thermopower.tolist()
 
 @plot
 def voltage_vs_gradient(data, ax=None, **kwargs):
@@ -368,15 +357,16 @@ def experiment_overview(data,ax=None):
 
 def cole_at_temp(sample, temp, ax=None, **kwargs):
     freq = sample.freq
-    data = sample.data
 
-    for i, run in enumerate(data.run.unique().dropna()):
-        tmp = data[data.run == run]
+    for i, run in enumerate(sample.groups['run']):
+        tmp = sample.rows('run', run)
         kwargs = dict(  
-            data=tmp, 
+            data=sample.data, 
+            row=sample.nearest_temp(temp, run=run)[0],
             freq=freq, 
             temp=temp,
             fit=True,
+            fits=sample.fits,
             label='{}{:+}'.format(tmp.buffer.unique()[0],tmp.offset.mode()[0]))
         if i != 0 or ax is not None:
             kwargs.update(ax=ax)
@@ -403,13 +393,16 @@ def cole_at_run(sample, run, temp_list, ax=None, **kwargs):
     """
     freq = sample.freq
     data = sample.run(run)
+    rows = sample.nearest_temp(temp_list, run=run)
 
-    for i, temp in enumerate(temp_list):
+    for i, (temp, row) in enumerate(zip(temp_list, rows)):
         kwargs = dict(  
-            data=data, 
+            data=sample.data, 
+            row=row,
             freq=freq, 
             temp=temp,
             fit=True,
+            fits=sample.fits,
             label='{} {}'.format(temp,degC))
         if i != 0 or ax is not None:
             kwargs.update(ax=ax)
@@ -436,15 +429,15 @@ def thermopower_base(data, ax=None):
     Returns:
         [type]: [description]
     """
-    steps = data.step.unique()
-    colors = ['r','b','g','c','m','y','k']
-
-    for step, c in zip(steps,color_cycle):
-        print(c)
+    table = processing.thermopower_table(data)
 
-        tmp = data.loc[data.step == step]
-        ax, _ = voltage_vs_gradient(tmp, ax=ax, **c)
-        # print(model.summary())
+    for (step, tmp), c in zip(thermopower_only(data).groupby('step'), color_cycle):
+        gradient = tmp.thermo_1 - tmp.thermo_2
+        ax.errorbar(gradient, tmp.voltage, yerr=tmp.volt_stderr, fmt='.', **c)
+        # steps without enough valid measurements have no fit
+        if step in table.index:
+            fit = table.loc[step]
+            ax.plot(gradient, fit.intercept + fit.slope * gradient, **c)
 
     # ax.set_title('Thermopower @ {temp:.0f}{units} [{run}]'.format(
     #     temp=data.temp.mean(),
@@ -471,8 +464,9 @@ def arrhenius(data, cycle='both', ax=None):
     """
     data = conductivity_only(data)
     data = data[data.hold_length == 0]
-    for ind, c in zip(data['run'].unique(),color_cycle):
-        run = data.loc[data.run == ind]
+    runs = processing.group_index(data, ['run'])['run']
+    for (ind, rows), c in zip(runs.items(),color_cycle):
+        run = data.iloc[rows]
         mean = int(np.mean([run.step.max(),run.step.min()]))
 
         if cycle in ['both','increasing']:
@@ -568,17 +562,20 @@ def bode(z, theta, freq=None):
     fig.tight_layout()
     plt.show()
 
-def impedance_at(data,freq):
-    ind = index_freq(freq)
-
-    z,theta = [], []
-
-    for z1, theta1 in zip(data.z, data.theta):
-        z.append(z1[ind[0]])
-        theta.append(theta1[ind[0]])
-    Re, Im = processing.get_Re_Im(z, theta)
+def impedance_at(data, freq, frequencies=None, method='nearest'):
+    """Real and imaginary impedance of every row of data at the measured frequency nearest to freq. See :func:`processing.impedance_at`.
 
-    return Re, Im, ind[1]
+    :param frequencies: the frequencies of the sweep. Defaults to the default sweep of Laboratory.set_frequencies.
+    :return: Re, Im and the frequency used
+    """
+    if isinstance(data, Sample):
+        frequencies, spectra = data.freq, data.spectra
+    else:
+        spectra = processing.spectrum_matrix(data.complex_z, max(len(z) for z in data.complex_z if isinstance(z, np.ndarray)))
+    if frequencies is None:
+        frequencies = np.around(np.geomspace(config.LCR['min_freq'], config.LCR['max_freq'], spectra.shape[1]))
+    z, freq = processing.impedance_at(frequencies, spectra, freq, method=method)
+    return z.real, z.imag, freq
 
 def inverseK2celsius(x):
     return 10000/x-273
@@ -634,7 +631,8 @@ def test(sample):
 
 class LivePlot1():
 
-    def __init__(self):
+    def __init__(self, freq=None):
+        self.freq = freq
         self.fig, ax = plt.subplots(5,1, sharex=True, num='Live Plot 1')
         plt.subplots_adjust(hspace=.1)
         self.ax = {
@@ -653,9 +651,14 @@ class LivePlot1():
         data = processing.process_data(data, area, thickness)
         # hours = data.index.seconds / 60 / 60 + data.index.days * 24
 
+        # update modelled conductivity as the background fits arrive
+        if 'resistance' in data:
+            modelled = processing.get_conductivity(data.resistance, area, thickness)
+            self.model_conductivity.set_data(data.index, np.log10(modelled))
+
         # update conductivity
-        Re,_,freq = impedance_at(data,freq)
-        conductivity = np.log10((1/Re)*(area / thickness))
+        Re,_,freq = impedance_at(data,freq,self.freq)
+        conductivity = np.log10(processing.get_conductivity(Re, area, thickness))
         self.conductivity.set_data(data.index,conductivity)
         self.ax['conductivity'].add_artist(AnchoredText('@{} Hz'.format(freq), loc=1))
 
@@ -729,6 +732,7 @@ class LivePlot1():
         """Plots conductivity versus time"""
         ax = format_time_axis(ax)
         self.conductivity, = ax.plot(*self.x(),'.')
+        self.model_conductivity, = ax.plot(*self.x(),'r.', label='Modelled')
 
         # ax.set_ylabel('Conductivity [S]')
         ax.set_ylabel('Conductivity [S/m]')
@@ -771,7 +775,7 @@ class LivePlot2():
         z, theta = data.z[-1], data.theta[-1]
         Re, Im = processing.get_Re_Im(z, theta)
         # update cole plot
-        self.cole.set_data(Re/1000, Im/1000)
+        self.cole.set_data(Re/1000, -Im/1000)
 
         # update bode plot
         self.bode_z.set_data(self.freq[:len(z)], z)
@@ -779,8 +783,8 @@ class LivePlot2():
 
 
         # get impedance at a particular freq for the entire dataset
-        Re,_,freq = impedance_at(data,freq)
-        conductivity = np.log10((1/Re)*(area / thickness))
+        Re,_,freq = impedance_at(data,freq,self.freq)
+        conductivity = np.log10(processing.get_conductivity(Re, area, thickness))
 
         self.arrhenius.set_data(10000/data.kelvin, conductivity)
         self.ax['arrhenius'].add_artist(AnchoredText('@{} Hz'.format(freq), loc=1))
@@ -873,7 +877,7 @@ if __name__ == '__main__':
     theta = [-1.40E+00, -1.13E+00, -8.10E-01, -1.41E+00, -1.54E+00]
     freq = [1.59E+02, 1.59E+03, 1.59E+04, 1.59E+05, 1.59E+06]
     # convert z and theta to real and imaginary components
-    Re, Im = get_Re_Im(z, theta)
+    Re, Im = processing.get_Re_Im(z, theta)
     plt.scatter(Re, Im, c=freq, norm=colors.LogNorm())
     plt.show()
     # print(_calculate_conductivity(z,theta))
@@ -1,12 +1,15 @@
 import pandas as pd
 import numpy as np
-from scipy import optimize
 from laboratory import config, modelling
 from impedance import preprocessing
 # from impedance.models.circuits
 from impedance import visualization
-import math 
-import os, glob, json
+import os, sys, glob, json, hashlib, shutil, warnings
+from datetime import timedelta
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import atexit
+from tqdm import tqdm
 
 
 BUFFERS = dict(
@@ -61,8 +64,17 @@ BUFFERS = dict(
 class Sample():
     area = None
     thickness = None
+    _groups = None
+    _grouped = None
 
-    def __init__(self, project_folder):
+    def __init__(self, project_folder, cache=True, derived=None, load=True):
+        """
+        Args:
+            project_folder (str): folder of the experiment
+            cache (bool, optional): use the processed data cache, see :meth:`load_data`. Defaults to True.
+            derived (list, optional): derived columns to compute when loading, e.g. ['temp'] to plot temperature against time. Others are computed when first needed, see :meth:`require`. Defaults to every derived column.
+            load (bool, optional): load the data. Only the sample info and control file are read otherwise, as used by :func:`process_chunks`. Defaults to True.
+        """
         self.directory = project_folder
 
         # saves the info from sample.json onto the class instance
@@ -76,7 +88,8 @@ class Sample():
         self.control_file = self.get_control_file()
 
         # loads the collected data for the given sample
-        self.data = self.load_data()
+        if load:
+            self.data = self.load_data(cache, derived)
         
     def __str__(self):
         return ',\n'.join(str(dict(
@@ -85,48 +98,265 @@ class Sample():
             area = '{} mm^2'.format(self.area),
             thickness = '{} mm'.format(self.thickness),
             freq_range = '{}-{}'.format(self.freq[0],self.freq[-1]),
-            thermopower = not self.thermopower.empty,
-            conductivity = not self.conductivity.empty,
+            thermopower = 'thermo' in self.groups['type'],
+            conductivity = 'cond' in self.groups['type'],
         )).split(','))
 
     @property
     def thermopower(self):
-        return self.data[self.data.z.isnull()]
+        return self.rows('type', 'thermo')
 
     @property
     def conductivity(self):
-        return self.data[self.data.z.notnull()]
+        return self.rows('type', 'cond')
 
     def run(self, run_number):
-        return self.data[self.data.run == 'Run {}'.format(run_number)]
+        return self.rows('run', 'Run {}'.format(run_number))
 
     def step(self, step_number):
-        return self.data[self.data.step == step_number]
+        return self.rows('step', step_number)
+
+    @property
+    def temperature_index(self):
+        """The :class:`TemperatureIndex` of self.data, rebuilt when self.data is replaced"""
+        if getattr(self, '_temperature_index', None) is None or self._temperature_index.data is not self.data:
+            self.require('temp', 'complex_z', 'run')
+            self._temperature_index = TemperatureIndex(self.data)
+        return self._temperature_index
+
+    def nearest_temp(self, temps, run=None, leg=None):
+        """Positions of the impedance measurements closest to each temperature in temps, ready to index self.spectra or self.data.iloc. See :meth:`TemperatureIndex.nearest`."""
+        return self.temperature_index.nearest(temps, run, leg)
+
+    def compact(self, float32=None, spectra=None):
+        """Reduces the memory used by self.data. Text columns become categoricals and integer columns are downcast to the smallest type that holds their values, both without loss. The measurement columns in float32 are stored in single precision. The z and theta lists are dropped in favour of self.spectra, and complex_z becomes a view of each row of it.
+
+        Args:
+            float32 (list, optional): columns to store as float32. Defaults to config.COMPACT['float32'].
+            spectra (str, optional): dtype of self.spectra. Defaults to config.COMPACT['spectra'].
+
+        Returns:
+            pd.DataFrame: bytes used by each column (and the spectrum matrix) before and after
+        """
+        float32 = config.COMPACT['float32'] if float32 is None else float32
+        spectra = np.dtype(spectra or config.COMPACT['spectra'])
+
+        def usage(data, matrix):
+            memory = data.memory_usage(deep=True, index=True)
+            for name in data.columns[data.dtypes == object]:
+                memory[name] = sum(_deep_size(v, matrix) for v in data[name])
+            memory['spectra'] = matrix.nbytes if matrix is not None else 0
+            return memory
+
+        self.require('complex_z')
+        before = usage(self.data, getattr(self, '_spectra', None))
+        matrix = np.ascontiguousarray(self.spectra, dtype=spectra)
+
+        data = self.data.drop(columns=[c for c in ('z', 'theta') if c in self.data])
+        for name in data.columns:
+            column = data[name]
+            if column.dtype == object:
+                values = column.dropna()
+                if len(values) and all(isinstance(v, str) for v in values):
+                    data[name] = column.astype('category')
+            elif pd.api.types.is_integer_dtype(column):
+                data[name] = pd.to_numeric(column, downcast='integer')
+            elif name in float32 and pd.api.types.is_float_dtype(column):
+                data[name] = column.astype(np.float32)
+
+        has_spectrum = data.complex_z.notnull().to_numpy()
+        complex_z = np.empty(len(data), dtype=object)
+        complex_z[:] = [row if ok else None for row, ok in zip(matrix, has_spectrum)]
+        data['complex_z'] = complex_z
+
+        self.data = data
+        self._spectra = matrix
+
+        report = pd.DataFrame(dict(before=before, after=usage(data, matrix))).fillna(0).astype(int)
+        report.loc['total'] = report.sum()
+        return report
+
+    def impedance_at(self, freq, part='complex', method='nearest'):
+        """Impedance of every row at one or more frequencies. See :func:`impedance_at`.
+
+        Returns:
+            tuple: (values, frequencies) where values has one row per row of self.data
+        """
+        return impedance_at(self.freq, self.spectra, freq, part, method)
+
+    def window(self, start=None, end=None, step=None, run=None, columns=None):
+        """Measurements taken between start and end (inclusive), found by binary search on the measurement times. The rows are returned as slices of self.data and self.spectra rather than copies, unless only some columns are asked for.
+
+        Args:
+            start (str, datetime or timedelta, optional): first time, or time since the first measurement. Defaults to the start of the experiment.
+            end (str, datetime or timedelta, optional): last time, or time since the first measurement. Defaults to the end of the experiment.
+            step (int, optional): only rows from this step. Defaults to None.
+            run (int or str, optional): only rows from this run, e.g. 2 or 'Run 2'. Defaults to None.
+            columns (list, optional): only these columns of the data. Defaults to every column.
+
+        Returns:
+            tuple: (data, spectra) of the rows in the window
+        """
+        if isinstance(run, (int, np.integer)):
+            run = 'Run {}'.format(run)
+
+        rows = time_rows(self.data.time.to_numpy(), start, end)
+        for column, value in (('step', step), ('run', run)):
+            if value is not None:
+                rows = _intersect_rows(rows, self.groups[column].get(value, slice(0, 0)))
+
+        data = self.data.iloc[rows]
+        if columns is not None:
+            data = data[columns]
+        return data, self.spectra[rows]
+
+    @property
+    def groups(self):
+        """Positions of the rows of each run, step and measurement type in self.data, so selecting them doesn't scan the data. Built when first needed and again if self.data is replaced. See :func:`group_index`."""
+        if self._grouped is not self.data:
+            self.require('run', 'type')
+            self._groups = group_index(self.data, ['run', 'step', 'type'])
+            self._grouped = self.data
+        return self._groups
+
+    def rows(self, column, value):
+        """Rows of self.data where column equals value, looked up in self.groups rather than by comparing every row. Contiguous groups (every run and step) are returned as slices of the data."""
+        return self.data.iloc[self.groups[column].get(value, slice(0, 0))]
+
+    @property
+    def spectra(self):
+        """Complex impedance of every row as a single (rows x frequencies) array. Rows without an impedance sweep are nan."""
+        if getattr(self, '_spectra', None) is None:
+            self.require('complex_z')
+            self._spectra = spectrum_matrix(self.data.complex_z, len(self.freq))
+        return self._spectra
 
     def model_conductivity(self, 
             guess = [1e+5, 1e-10, 5e+6, 1e-10],
             circuit = 'p(R1,C1)-p(R2,C2)',
             ignore_below = 200,        
+            workers = 1,
+            warm_start = None,
+            batch = False,
+            cache = True,
+            skip_invalid = False,
+            progress = True,
             ):
-        result = []
-        for _, row in self.data.iterrows():
-            if isinstance(row.complex_z, np.ndarray):
-                result.append(modelling.model_conductivity(
-                    freq = self.freq,
-                    complex_z = row.complex_z,
-                    cutoff = ignore_below,
-                    circuit=circuit,
-                    guess=guess
-                    ))
-            else:
-                result.append([np.nan,np.nan,np.nan])
-
-        self.data['model'] = [r[0] for r in result]
-        self.data['resistance'] = [r[1] for r in result]
-        self.data['model_rmse'] = [r[2] for r in result]
-        self.data['conductivity'] = self.thickness_m / (self.data['resistance'] * self.area_m)
+        """Fits an equivalent circuit to every impedance spectrum and calculates conductivity from the modelled resistance. See :func:`modelling.fit_spectra`. The fits are kept in self.fits as a :class:`modelling.FitResult` with one row per row of data.
+
+        Args:
+            workers (int, optional): number of processes to fit with, None uses every core. Defaults to 1.
+            warm_start (str, optional): fit the spectra in order, seeding each fit from the 'previous' converged fit or by 'interpolate'-ing earlier fits in the same run in 1/T. The number of function evaluations is saved in model_nfev. See :func:`modelling.fit_sequential`. Defaults to None.
+            batch (bool, optional): fit all spectra together as one vectorised problem. See :func:`modelling.fit_batch`. Defaults to False.
+            cache (bool, optional): reuse fits of identical spectra with identical settings from the on-disk fit cache, and add new fits to it. Not used with warm_start, where a fit depends on the fits before it. See :func:`modelling.fit_cached`. Defaults to True.
+            skip_invalid (bool, optional): don't fit spectra that fail the Kramers-Kronig test, see :meth:`validate_spectra`. Defaults to False.
+            progress (bool, optional): display a progress bar. Defaults to True.
+        """
+        spectra = self.spectra
+        if skip_invalid:
+            if 'kk_valid' not in self.data:
+                self.validate_spectra(ignore_below)
+            spectra = np.where(self.data.kk_valid.to_numpy()[:, None], spectra, np.nan)
+
+        if warm_start:
+            self.require('kelvin', 'run')
+            result = modelling.fit_sequential(
+                freq = self.freq,
+                spectra = spectra,
+                cutoff = ignore_below,
+                circuit = circuit,
+                guess = guess,
+                kelvin = self.data.kelvin.to_numpy(),
+                runs = self.data.run.astype(str).to_numpy(),
+                mode = warm_start,
+                progress = progress,
+                )
+            self.data['model_nfev'] = [r[3] for r in result]
+        else:
+            fitter, kwargs = modelling.fit_spectra, dict(workers=workers)
+            if batch:
+                fitter, kwargs = modelling.fit_batch, {}
+            if cache:
+                fitter, kwargs = modelling.fit_cached, dict(fitter=fitter, **kwargs)
+            result = fitter(
+                freq = self.freq,
+                spectra = spectra,
+                cutoff = ignore_below,
+                circuit = circuit,
+                guess = guess,
+                progress = progress,
+                **kwargs
+                )
+
+        self.fits = modelling.FitResult.from_results(circuit, result)
+        self.data['resistance'] = self.fits.resistance
+        self.data['model_rmse'] = self.fits.rmse
+        self.data['conductivity'] = get_conductivity(self.data['resistance'], self.area, self.thickness)
         # self.data['conductivity_old'] = 1./self.data['resistance'] * self.geo_factor
 
+    def select_circuit(self, circuits=None, ignore_below=200, criterion='bic', **kwargs):
+        """Fits each of several candidate circuits and keeps the best for every spectrum. See :func:`modelling.select_circuit` for the keyword arguments.
+
+        Saves the best circuit of each row as circuit and its resistance and rmse as resistance and model_rmse. The fits of every candidate that wasn't pruned are kept in self.circuit_fits, the scores in self.circuit_scores, and self.fits holds the circuit that is best most often.
+
+        Args:
+            circuits (dict, optional): circuit string: initial guess of each candidate. Defaults to config.CIRCUITS.
+            criterion (str, optional): 'aic', 'bic' or 'rmse'. Defaults to 'bic'.
+        """
+        best, self.circuit_scores, self.circuit_fits = modelling.select_circuit(
+            freq = self.freq,
+            spectra = self.spectra,
+            cutoff = ignore_below,
+            circuits = circuits,
+            criterion = criterion,
+            **kwargs
+            )
+
+        resistance = np.full(len(self.data), np.nan)
+        rmse = np.full(len(self.data), np.nan)
+        for circuit, fits in self.circuit_fits.items():
+            rows = best == circuit
+            resistance[rows] = fits.resistance[rows]
+            rmse[rows] = fits.rmse[rows]
+
+        self.data['circuit'] = pd.Categorical(best, categories=list(self.circuit_fits))
+        self.data['resistance'] = resistance
+        self.data['model_rmse'] = rmse
+        self.data['conductivity'] = get_conductivity(self.data['resistance'], self.area, self.thickness)
+        self.fits = self.circuit_fits[self.data.circuit.value_counts().idxmax()]
+
+    def validate_spectra(self, ignore_below=200, **kwargs):
+        """Runs the Kramers-Kronig test on every spectrum, see :func:`modelling.lin_kk` for the keyword arguments. Saves the rms relative residual as kk_residual and whether the spectrum passed as kk_valid."""
+        result = modelling.lin_kk(self.freq, self.spectra, ignore_below, **kwargs)
+        self.data['kk_residual'] = result['residual']
+        self.data['kk_valid'] = result['valid']
+
+    def relaxation_times(self, ignore_below=200, **kwargs):
+        """Calculates the distribution of relaxation times of every spectrum, see :func:`modelling.drt` for the keyword arguments. The result is kept in self.drt, and the high frequency resistance and total (high frequency plus polarisation) resistance saved as drt_r_inf and drt_resistance."""
+        self.drt = modelling.drt(self.freq, self.spectra, ignore_below, **kwargs)
+        self.data['drt_r_inf'] = self.drt['r_inf']
+        self.data['drt_resistance'] = self.drt['r_inf'] + self.drt['r_polarisation']
+        return self.drt
+
+    def estimate_conductivity(self, ignore_below=200, method='circle'):
+        """Estimates resistance and conductivity from every spectrum without fitting a circuit, see :func:`modelling.estimate_resistance`. Saves resistance_circle, resistance_intercept, resistance_peak and capacitance_peak, and conductivity_estimate calculated from the chosen method.
+
+        Args:
+            method (str, optional): 'circle', 'intercept' or 'peak'. Defaults to 'circle'.
+
+        Returns:
+            pd.DataFrame: agreement of each estimate with the fitted resistance, see :func:`modelling.agreement`. Empty if model_conductivity has not been run.
+        """
+        estimates = modelling.estimate_resistance(self.freq, self.spectra, ignore_below)
+        for name in ['circle', 'intercept', 'peak']:
+            self.data['resistance_' + name] = estimates[name]
+        self.data['capacitance_peak'] = estimates['capacitance']
+        self.data['conductivity_estimate'] = get_conductivity(estimates[method], self.area, self.thickness)
+
+        if 'resistance' not in self.data:
+            return pd.DataFrame()
+        return modelling.agreement(estimates, self.data.resistance)
+
     def get_sample_info(self):
         with open(os.path.join(self.directory, 'sample.json')) as f:
             sample = json.load(f)
@@ -136,107 +366,257 @@ class Sample():
     def get_control_file(self):
         return pd.read_csv(os.path.join(self.directory, 'control_file.csv'))
 
-    def load_data(self):
-        """loads a previous experiment for processing and analysis
+    def load_data(self, cache=True, derived=None):
+        """loads a previous experiment for processing and analysis. The processed data is cached in a config.PROCESSED_DIR folder inside the project folder and reused until the raw files change, see :func:`write_processed`.
+
+        :param cache: read and write the processed data cache
+        :type cache: bool
 
-        :param project_folder: name of experiment
-        :type project_folder: str
+        :param derived: derived columns to compute, see :meth:`process_data`
+        :type derived: list
         """
-        data = pd.read_pickle(glob.glob(os.path.join(self.directory, '*.pkl'))[0])     
+        raw = [glob.glob(os.path.join(self.directory, '*.pkl'))[0],
+            os.path.join(self.directory, 'sample.json'),
+            os.path.join(self.directory, 'control_file.csv')]
+        directory = os.path.join(self.directory, config.PROCESSED_DIR)
+
+        if cache:
+            data = read_processed(directory, raw)
+            if data is not None:
+                cached = set(data.columns)
+                data = self._derive(data, DERIVED if derived is None else derived)
+                if set(data.columns) - cached:
+                    # the cache was written by a load that derived fewer columns, add these so they aren't derived again
+                    self._write_cache(directory, data, raw)
+                return data
+
+        data = pd.read_pickle(raw[0])     
 
         # load sample.json and send sample specs to process data function
-        return self.process_data(data)
+        data = self.process_data(data, derived)
 
-    def process_data(self, data):
-        data['time'] = data.index
-        data['time_elapsed'] = data.time-data.time[0]
+        if cache:
+            self._write_cache(directory, data, raw)
+        return data
 
-        tdelta = []
-        for step in data.step.unique():
-            tmp = data[data.step == step]
-            tdelta.append(tmp.time-tmp.time.iloc[0])
-        
-        data['time_from_step'] = pd.concat(tdelta)  
+    def _write_cache(self, directory, data, raw):
+        try:
+            write_processed(directory, data, fingerprint(raw, (processed_meta(directory) or {}).get('files')))
+        except OSError as e:
+            warnings.warn('Could not cache the processed data: {}'.format(e))
+
+    def process_data(self, data, derived=None):
+        """Joins the control file onto the raw data and computes the derived columns in derived (all of them by default). Any others are computed when first needed, see :meth:`require`."""
+        data['time'] = data.index
 
         if not 'step' in self.control_file.columns:
             self.control_file['step'] = self.control_file.index       
         data = pd.merge(data,self.control_file,on='step')
+        # rows in time order so time windows are contiguous, see Sample.window
+        data = data.sort_values('time', kind='stable', ignore_index=True)
+
+        return self._derive(data, DERIVED if derived is None else derived)
+
+    def _derive(self, data, names):
+        for name in names:
+            if name in data or name not in DERIVED:
+                continue
+            inputs, func = DERIVED[name]
+            self._derive(data, inputs)
+            data[name] = func(self, data)
+        return data
 
-        # print(data)
+    def require(self, *names):
+        """Computes the derived columns in names, and any derived columns they are calculated from, that aren't in self.data yet. Columns already present are left alone."""
+        missing = [name for name in names if name not in self.data]
+        if missing:
+            self._derive(self.data, missing)
+
+    def __getitem__(self, name):
+        """A column of self.data, computed first if it is a derived column that hasn't been needed yet, e.g. ``sample['kelvin']``"""
+        self.require(name)
+        return self.data[name]
+
+    def set_column(self, name, values):
+        """Replaces a column of self.data and drops every derived column calculated from it. They are recomputed when next needed."""
+        self.data[name] = values
+        self.invalidate(name)
+
+    def invalidate(self, *names):
+        """Drops the derived columns that depend on any of names, along with anything cached from them"""
+        stale = dependents(names)
+        self.data.drop(columns=[name for name in stale if name in self.data], inplace=True)
+        if stale & {'complex_z'}:
+            self._spectra = None
+        self._thermopower_table = None
+        self._temperature_index = None
+        self._grouped = None
+
+# columns of Sample.data calculated from others: name -> (input columns, function of the sample and data)
+DERIVED = {}
+
+def derived_column(name, *inputs):
+    """Registers the decorated function as the way to compute column name of Sample.data from the input columns. Inputs that are themselves derived columns are computed first."""
+    def register(func):
+        DERIVED[name] = (inputs, func)
+        return func
+    return register
+
+def dependents(names):
+    """The derived columns calculated directly or indirectly from any of names"""
+    found, queue = set(), list(names)
+    while queue:
+        column = queue.pop()
+        for name, (inputs, _) in DERIVED.items():
+            if column in inputs and name not in found:
+                found.add(name)
+                queue.append(name)
+    return found
+
+@derived_column('time_elapsed', 'time')
+def _time_elapsed(sample, data):
+    return data.time - data.time.iloc[0]
+
+@derived_column('time_from_step', 'time', 'step')
+def _time_from_step(sample, data):
+    return data.time - data.groupby('step').time.transform('first')
+
+@derived_column('temp', 'thermo_1', 'thermo_2')
+def _temp(sample, data):
+    return data[['thermo_1','thermo_2']].mean(axis=1)
+
+@derived_column('kelvin', 'temp')
+def _kelvin(sample, data):
+    return data.temp+273.18
+
+@derived_column('gradient', 'thermo_1', 'thermo_2')
+def _gradient(sample, data):
+    return data.thermo_1 - data.thermo_2
+
+@derived_column('log10_fugacity', 'temp', 'co2', 'co', 'h2', 'fo2_gas', 'fugacity')
+def _log10_fugacity(sample, data):
+    return actual_fugacity(data)
+
+@derived_column('actual_fugacity', 'log10_fugacity')
+def _actual_fugacity(sample, data):
+    return 10**data.log10_fugacity
+
+@derived_column('complex_z', 'z', 'theta')
+def _complex_z(sample, data):
+    complex_z = np.empty(len(data), dtype=object)
+    complex_z[:] = [to_complex_z(row) for row in data[['z', 'theta']].itertuples(index=False)]
+    return complex_z
+
+@derived_column('type', 'complex_z')
+def _type(sample, data):
+    return np.where(data.complex_z.notnull(), 'cond','thermo')
+
+@derived_column('run', 'step')
+def _run(sample, data):
+    # find each row of control file where hold length is greater than 0, this will be our slice points for seperating temperature runs
+    hold_index = list(sample.control_file.index[sample.control_file.hold_length > 0])
+    labels = ['Run {}'.format(i+1) for i,_ in enumerate(hold_index)]
+    return pd.cut(data.loc[:,'step'],list(hold_index) + [float('Inf')], labels=labels)
+
+# Gibbs free energy polynomials in temperature (u'\N{DEGREE SIGN}C), highest order first
+GIBBS_CO = np.array([-7.3430182e-15, -4.5574288e-12, 4.720325e-7, -2.144446e-2, 62.110326])
+GIBBS_H2 = np.array([-1.1232833e-13, 7.6484887e-10, -2.0800406e-6, -1.1212207e-2, 55.025254])
+T0 = 273.18      # conversion C to K
+RGC = .00198726  # gas constant
+
+def _compile_buffers(buffers):
+    """Packs the coefficients of each buffer into arrays so that :func:`fo2_buffer` can evaluate any number of buffers and temperatures at once. Buffers without a transition temperature use a1 at all temperatures."""
+    names = list(buffers)
+    a1 = np.zeros((len(names), 3))
+    a2 = np.zeros((len(names), 3))
+    tc = np.full(len(names), np.inf)
+    for i, name in enumerate(names):
+        coefficients = buffers[name]
+        a1[i, :len(coefficients['a1'])] = coefficients['a1']
+        high = coefficients.get('a2', coefficients['a1'])
+        a2[i, :len(high)] = high
+        tc[i] = coefficients.get('Tc', np.inf)
+    return {name: i for i, name in enumerate(names)}, a1, a2, tc
+
+_BUFFER_INDEX, _BUFFER_A1, _BUFFER_A2, _BUFFER_TC = _compile_buffers(BUFFERS)
 
-        data['temp'] = data[['thermo_1','thermo_2']].mean(axis=1)
-        data['kelvin'] = data.temp+273.18
-        data['gradient'] = data.thermo_1 - data.thermo_2
-        data['log10_fugacity'] = data.apply(lambda x: actual_fugacity(x), axis=1)
-        data['actual_fugacity'] = 10**data.log10_fugacity
-        data['complex_z'] = data.apply(lambda x: to_complex_z(x), axis=1)
-        data['type'] = np.where(data.z.notnull(), 'cond','thermo')
+def fo2_buffer(temp, buffer, pressure=1.01325):
+    """Calculates the oxygen fugacity of a buffer at a given temperature. Both temp and buffer may be arrays and are broadcast against each other, e.g. ``fo2_buffer(temps, np.array(['qfm', 'iw'])[:, None])`` gives a curve for each buffer.
 
+    :param temp: temperature (u'\N{DEGREE SIGN}C)
+    :type temp: float, array
 
-        # if drop_prep:
-            # data = data.loc[data.step.between(0,data.step.max()-1)].copy()
-        # print(data)
+    :param buffer: name of the buffer (see BUFFERS)
+    :type buffer: str, array
 
-        # compute index for each temperature run
-        # find each row of control file where hold length is greater than 0, this will be our slice points for seperating temperature runs
-        hold_index = list(self.control_file.index[self.control_file.hold_length > 0])
-        labels = ['Run {}'.format(i+1) for i,_ in enumerate(hold_index)]
-        data['run'] = pd.cut(data.loc[:,'step'],list(hold_index) + [float('Inf')], labels=labels)
+    :returns: oxygen fugacity (log Pa), nan for unknown buffers
+    :rtype: float, array
+    """
+    buffer = np.asarray(buffer)
+    index = np.array([_BUFFER_INDEX.get(b, -1) for b in buffer.ravel()], dtype=int).reshape(buffer.shape)
+    known = index >= 0
+    index = np.where(known, index, 0)
 
-        # print(data)
+    temp = np.asarray(temp, dtype=float) + 273  # convert Celsius to Kelvin
+    index, temp, known = np.broadcast_arrays(index, temp, known)
 
-        return data
+    a = np.where((temp > _BUFFER_TC[index])[..., None], _BUFFER_A2[index], _BUFFER_A1[index])
+    fug = a[..., 0]/temp + a[..., 1] + a[..., 2]*(pressure - 1e5)/temp
 
-def parabola(x, a, b, c):
-    return np.multiply(a, np.square(x)) + np.multiply(b, x) + c
+    return np.where(known, fug, np.nan)[()]
 
-def fo2_buffer(temp, buffer, pressure=1.01325):
+def buffer_curves(temp, buffers=None, offsets=0, fo2_gas=None, pressure=1.01325):
+    """Evaluates every combination of buffer and offset over a range of temperatures in a single call. If fo2_gas is given, the gas ratio required to hold each curve is returned instead of the fugacity.
 
-    def fug(buffer, temp, pressure):
-        temp = temp+273  # convert Celsius to Kelvin
+    :param temp: temperatures (u'\N{DEGREE SIGN}C)
+    :type temp: array
 
-        if temp > buffer.get('Tc', False):
-            a = buffer['a2']
-        else:
-            a = buffer['a1']
+    :param buffers: buffer names. Defaults to all of BUFFERS.
+    :type buffers: list
 
-        if len(a) == 2:
-            return a[0]/temp + a[1]
-        elif len(a) == 3:
-            return a[0]/temp + a[1] + a[2]*(pressure - 1e5)/temp
+    :param offsets: offsets from each buffer (log Pa)
+    :type offsets: float, list
 
-    try:
-        return fug(BUFFERS[buffer], temp, pressure)
-    except KeyError:
-        pass
+    :param fo2_gas: either 'co' or 'h2'
+    :type fo2_gas: str
+
+    :returns: a table indexed by temperature with a column for each (buffer, offset)
+    :rtype: pd.DataFrame
+    """
+    temp = np.atleast_1d(np.asarray(temp, dtype=float))
+    buffers = list(BUFFERS) if buffers is None else list(np.atleast_1d(buffers))
+    offsets = np.atleast_1d(np.asarray(offsets, dtype=float))
+
+    # shape (buffer, offset, temp)
+    result = fo2_buffer(temp, np.array(buffers)[:, None, None], pressure) + offsets[:, None]
+    if fo2_gas == 'co':
+        result = fugacity_co(result, temp)
+    elif fo2_gas == 'h2':
+        result = fugacity_h2(result, temp)
+
+    return pd.DataFrame(result.reshape(-1, temp.size).T,
+        index=pd.Index(temp, name='temp'),
+        columns=pd.MultiIndex.from_product([buffers, offsets], names=['buffer', 'offset']))
+
+def equilibrium_constant(gibbs, temp):
+    """Equilibrium constant of a reaction at a given temperature (u'\N{DEGREE SIGN}C) from its Gibbs free energy polynomial (GIBBS_CO or GIBBS_H2)."""
+    temp = np.asarray(temp)
+    return np.exp(-np.polyval(gibbs, temp)/RGC/(temp + T0))
 
 def fugacity_co(fo2p, temp):
-    """Calculates the ratio CO2/CO needed to maintain a constant oxygen fugacity at a given temperature.
+    """Calculates the ratio CO2/CO needed to maintain a constant oxygen fugacity at a given temperature. Arrays are broadcast against each other.
 
     :param fo2p: desired oxygen fugacity (log Pa)
-    :type fo2p: float, int
+    :type fo2p: float, array
 
     :param temp: temperature (u'\N{DEGREE SIGN}C)
-    :type temp: float, int
+    :type temp: float, array
 
     :returns: CO2/CO ratio
-    :rtype: float
+    :rtype: float, array
     """
-
-    a10 = 62.110326
-    a11 = -2.144446e-2
-    a12 = 4.720325e-7
-    a13 = -4.5574288e-12
-    a14 = -7.3430182e-15
-
-    t0 = 273.18      # conversion C to K
-    rgc = .00198726  # gas constant
-
-    tk = temp + t0
-    fo2 = 1.01325*(10**(fo2p-5))  # convert Pa to atm
-
-    g1 = (((a14*temp+a13)*temp+a12)*temp+a11)*temp+a10  # Gibbs free energy
-    k1 = math.exp(-g1/rgc/tk)  # equilibrium constant
+    fo2 = 1.01325*(10.**(np.asarray(fo2p)-5))  # convert Pa to atm
+    k1 = equilibrium_constant(GIBBS_CO, temp)
 
     CO = k1 - 3*k1*fo2 - 2*fo2**1.5
     CO2 = 2*k1*fo2 + fo2 + fo2**1.5 + fo2**0.5
@@ -244,39 +624,20 @@ def fugacity_co(fo2p, temp):
     return CO2/CO
 
 def fugacity_h2(fo2p, temp):
-    """Calculates the ratio CO2/H2 needed to maintain a constant oxygen fugacity at a given temperature.
+    """Calculates the ratio CO2/H2 needed to maintain a constant oxygen fugacity at a given temperature. Arrays are broadcast against each other.
 
     :param fo2p: desired oxygen fugacity (log Pa)
-    :type fo2p: float, int
+    :type fo2p: float, array
 
     :param temp: temperature (u'\N{DEGREE SIGN}C)
-    :type temp: float, int
+    :type temp: float, array
 
     :returns: CO2/H2 ratio
-    :rtype: float
+    :rtype: float, array
     """
-    a10 = 62.110326
-    a11 = -2.144446e-2
-    a12 = 4.720325e-7
-    a13 = -4.5574288e-12
-    a14 = -7.3430182e-15
-
-    a30 = 55.025254
-    a31 = -1.1212207e-2
-    a32 = -2.0800406e-6
-    a33 = 7.6484887e-10
-    a34 = -1.1232833e-13
-
-    t0 = 273.18      # conversion C to K
-    rgc = .00198726  # gas constant
-
-    tk = temp + t0
-    fo2 = 1.01325*(10**(fo2p-5))  # convert Pa to atm
-
-    g1 = (((a14*temp+a13)*temp+a12)*temp+a11)*temp+a10  # Gibbs free energy
-    g3 = (((a34*temp+a33)*temp+a32)*temp+a31)*temp+a30  # Gibbs free energy
-    k1 = math.exp(-g1/rgc/tk)  # equilibrium constant
-    k3 = math.exp(-g3/rgc/tk)  # equilibrium constant
+    fo2 = 1.01325*(10.**(np.asarray(fo2p)-5))  # convert Pa to atm
+    k1 = equilibrium_constant(GIBBS_CO, temp)
+    k3 = equilibrium_constant(GIBBS_H2, temp)
 
     a = k1/(k1 + fo2**0.5)
     b = fo2**0.5/(k3 + fo2**0.5)
@@ -286,22 +647,257 @@ def fugacity_h2(fo2p, temp):
 
     return CO2/H2
 
-def actual_fugacity(data):
-    try:
-        if data.fo2_gas == 'co':
-            ratio = data.co2/data.co
-            func = fugacity_co
-        else:
-            ratio = data.co2/data.h2
-            func = fugacity_h2
-    except ZeroDivisionError:
-        return np.nan
-    
-    fugacity_list = np.linspace(data.fugacity-.1,data.fugacity+.1,10)
-    r = [func(f, data.temp) for f in fugacity_list]  
+def fugacity_from_ratio(ratio, temp, func, guess=None, tol=1e-10, maxiter=50):
+    """Finds the oxygen fugacity that produces a given gas ratio at a given temperature. This is the inverse of :func:`fugacity_co` and :func:`fugacity_h2` and works on whole arrays at once using Newton's method on log(ratio), which is very nearly linear in log fo2p. The derivative is found by complex step so it is exact to machine precision.
+
+    :param ratio: measured CO2/CO or CO2/H2 ratio
+    :type ratio: float, array
+
+    :param temp: temperature (u'\N{DEGREE SIGN}C)
+    :type temp: float, array
+
+    :param func: either :func:`fugacity_co` or :func:`fugacity_h2`
+    :type func: callable
 
-    popt2 = optimize.curve_fit(parabola, r, fugacity_list)[0]
-    return parabola(ratio, *popt2)
+    :param guess: starting point for the solver (log Pa), usually the target fugacity. Defaults to -10.
+    :type guess: float, array
+
+    :returns: oxygen fugacity (log Pa), nan wherever the ratio is zero, infinite or the solver failed to converge
+    :rtype: array
+    """
+    ratio, temp = np.broadcast_arrays(
+        np.asarray(ratio, dtype=float), np.asarray(temp, dtype=float))
+    shape = ratio.shape
+    ratio, temp = ratio.ravel(), temp.ravel()
+    if guess is None:
+        guess = -10.
+    x = np.broadcast_to(np.asarray(guess, dtype=float), shape).ravel().copy()
+    x[~np.isfinite(x)] = -10.
+
+    # zero flow of either gas gives a ratio of 0 or inf which has no solution
+    with np.errstate(divide='ignore', invalid='ignore'):
+        target = np.log(ratio)
+    active = np.isfinite(target) & np.isfinite(temp)
+    converged = np.zeros(ratio.shape, dtype=bool)
+
+    h = 1e-20
+    for _ in range(maxiter):
+        if not active.any():
+            break
+        with np.errstate(all='ignore'):
+            r = func(x[active] + 1j*h, temp[active])
+            residual = np.log(r.real) - target[active]
+            derivative = (r.imag / h) / r.real
+
+        # limit the step size so a poor guess can't jump out of the physical range
+        dx = np.clip(residual / derivative, -2, 2)
+        dx[~np.isfinite(dx)] = np.nan
+
+        x[active] = x[active] - dx
+        done = np.abs(dx) < tol
+        failed = np.isnan(dx)
+
+        index = np.flatnonzero(active)
+        converged[index[done]] = True
+        active[index[done | failed]] = False
+
+    x[~converged] = np.nan
+    return x.reshape(shape)
+
+class _Grid():
+    """A regular 2-D grid of values with bilinear interpolation. Cells flagged in ``ok`` as not meeting the tolerance return nan."""
+
+    def __init__(self, x, y, values, ok):
+        self.x, self.y = x, y
+        self.values, self.ok = values, ok
+
+    def __call__(self, x, y):
+        i = (x - self.x[0]) / (self.x[1] - self.x[0])
+        j = (y - self.y[0]) / (self.y[1] - self.y[0])
+        with np.errstate(invalid='ignore'):
+            inside = (i >= 0) & (i <= self.x.size - 1) & (j >= 0) & (j <= self.y.size - 1)
+        i = np.where(inside, i, 0)
+        j = np.where(inside, j, 0)
+        i0 = np.minimum(i.astype(int), self.x.size - 2)
+        j0 = np.minimum(j.astype(int), self.y.size - 2)
+        u, v = i - i0, j - j0
+
+        v00, v10 = self.values[i0, j0], self.values[i0+1, j0]
+        v01, v11 = self.values[i0, j0+1], self.values[i0+1, j0+1]
+        result = (1-u)*(1-v)*v00 + u*(1-v)*v10 + (1-u)*v*v01 + u*v*v11
+        return np.where(inside & self.ok[i0, j0], result, np.nan)
+
+    @classmethod
+    def refine(cls, func, x_range, y_range, tolerance, max_size):
+        """Doubles the grid resolution until bilinear interpolation matches func to within tolerance at the edge midpoints and centre of each cell, or until max_size is reached. Cells that still exceed the tolerance are flagged so that they are never used."""
+        n = [9, 9]
+        while True:
+            x, y = np.linspace(*x_range, n[0]), np.linspace(*y_range, n[1])
+            xm, ym = (x[:-1] + x[1:])/2, (y[:-1] + y[1:])/2
+            values = func(x[:, None], y[None, :])
+
+            with np.errstate(invalid='ignore'):
+                # interpolation error along each axis and at the centre of each cell
+                ex = np.abs(func(xm[:, None], y[None, :]) - (values[:-1] + values[1:])/2)
+                ey = np.abs(func(x[:, None], ym[None, :]) - (values[:, :-1] + values[:, 1:])/2)
+                ec = np.abs(func(xm[:, None], ym[None, :]) -
+                    (values[:-1, :-1] + values[1:, :-1] + values[:-1, 1:] + values[1:, 1:])/4)
+                error = np.fmax.reduce([ex[:, :-1], ex[:, 1:], ey[:-1], ey[1:], ec])
+                ok = error <= tolerance
+
+            refine_x = np.nanmax(np.fmax(ex[:, :-1], ex[:, 1:])) > tolerance
+            refine_y = np.nanmax(np.fmax(ey[:-1], ey[1:])) > tolerance
+            if np.nanmax(ec) > tolerance and not (refine_x or refine_y):
+                refine_x = refine_y = True
+
+            # the ratio is singular just beyond the edge of the valid region so a handful of cells
+            # there may never converge. Stop once they are all that is left, they won't be used.
+            finished = ok.sum() >= 0.999 * np.isfinite(error).sum()
+            if finished or not (refine_x or refine_y) or 2*max(n) - 1 > max_size:
+                return cls(x, y, values, ok)
+
+            if refine_x:
+                n[0] = 2*n[0] - 1
+            if refine_y:
+                n[1] = 2*n[1] - 1
+
+
+class GasRatioTable():
+    """Lookup tables relating oxygen fugacity to the CO2/CO or CO2/H2 gas ratio over the operating range of the furnace (see config.GAS_TABLE). The forward table maps (temperature, log fo2p) to log10 ratio and the inverse table maps (temperature, log10 ratio) to log fo2p.
+
+    Each table is refined until bilinear interpolation agrees with the exact solution to within the tolerance at the edge midpoints and centre of every cell. Queries outside the table, or in the few cells that can't meet the tolerance, fall back to the exact calculation. Tables are built once and saved to config.CACHE_DIR. Use :func:`gas_ratio_table` to get a shared instance.
+
+    :Example:
+
+    >>> table = gas_ratio_table('co')
+    >>> ratio = table.ratio(fo2_buffer(temps, 'qfm'), temps)
+    >>> table.fugacity(ratio, temps)
+    """
+    version = 1
+
+    def __init__(self, fo2_gas, temp_range, fugacity_range, ratio_range, tolerance, max_size):
+        self.fo2_gas = fo2_gas
+        self.func = {'co': fugacity_co, 'h2': fugacity_h2}[fo2_gas]
+        self.temp_range = temp_range
+        self.fugacity_range = fugacity_range
+        self.ratio_range = ratio_range
+        self.tolerance = tolerance
+        self.max_size = max_size
+        self.forward, self.inverse = None, None
+
+    @property
+    def filename(self):
+        settings = repr((self.version, self.fo2_gas, self.temp_range, self.fugacity_range,
+            self.ratio_range, self.tolerance, self.max_size, GIBBS_CO.tolist(), GIBBS_H2.tolist()))
+        key = hashlib.md5(settings.encode()).hexdigest()[:12]
+        return 'gas_ratio_{}_{}.npz'.format(self.fo2_gas, key)
+
+    def build(self):
+        self.forward = _Grid.refine(self._log_ratio,
+            self.temp_range, self.fugacity_range, self.tolerance, self.max_size)
+        self.inverse = _Grid.refine(self._fugacity,
+            self.temp_range, self.ratio_range, self.tolerance, self.max_size)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        arrays = {}
+        for name in ['forward', 'inverse']:
+            grid = getattr(self, name)
+            arrays.update({'{}_{}'.format(name, k): getattr(grid, k) for k in ['x', 'y', 'values', 'ok']})
+        np.savez(os.path.join(directory, self.filename), **arrays)
+
+    def load(self, directory):
+        with np.load(os.path.join(directory, self.filename)) as f:
+            for name in ['forward', 'inverse']:
+                setattr(self, name, _Grid(*[f['{}_{}'.format(name, k)] for k in ['x', 'y', 'values', 'ok']]))
+
+    def ratio(self, fo2p, temp):
+        """Gas ratio needed to hold fo2p (log Pa) at temp (u'\N{DEGREE SIGN}C)."""
+        fo2p, temp = np.broadcast_arrays(np.asarray(fo2p, dtype=float), np.asarray(temp, dtype=float))
+        result = 10.**self.forward(temp, fo2p)
+
+        missing = np.isnan(result)
+        if missing.any():
+            result[missing] = self.func(fo2p[missing], temp[missing])
+        return result[()]
+
+    def fugacity(self, ratio, temp, guess=None):
+        """Oxygen fugacity (log Pa) produced by a gas ratio at temp (u'\N{DEGREE SIGN}C). See :func:`fugacity_from_ratio`."""
+        ratio, temp = np.broadcast_arrays(np.asarray(ratio, dtype=float), np.asarray(temp, dtype=float))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = self.inverse(temp, np.log10(ratio))
+
+        missing = np.isnan(result)
+        if missing.any():
+            if guess is not None:
+                guess = np.broadcast_to(guess, ratio.shape)[missing]
+            result[missing] = fugacity_from_ratio(ratio[missing], temp[missing], self.func, guess)
+        return result[()]
+
+    def _log_ratio(self, temp, fo2p):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_ratio = np.log10(self.func(fo2p, temp))
+            log_ratio[(log_ratio < self.ratio_range[0]) | (log_ratio > self.ratio_range[1])] = np.nan
+        return log_ratio
+
+    def _fugacity(self, temp, log_ratio):
+        temp, log_ratio = np.broadcast_arrays(temp, log_ratio)
+        return fugacity_from_ratio(10.**log_ratio, temp, self.func, maxiter=100)
+
+
+_GAS_RATIO_TABLES = {}
+
+def gas_ratio_table(fo2_gas, directory=None):
+    """Returns the shared :class:`GasRatioTable` for fo2_gas ('co' or 'h2'). The table is read from disk if it has been built before, otherwise it is built and saved for next time.
+
+    :param directory: where tables are cached. Defaults to config.CACHE_DIR
+    :type directory: str
+    """
+    if fo2_gas not in _GAS_RATIO_TABLES:
+        directory = directory or config.CACHE_DIR
+        table = GasRatioTable(fo2_gas, **config.GAS_TABLE)
+        try:
+            table.load(directory)
+        except (OSError, KeyError):
+            table.build()
+            try:
+                table.save(directory)
+            except OSError as e:
+                warnings.warn('Could not cache the gas ratio table: {}'.format(e))
+        _GAS_RATIO_TABLES[fo2_gas] = table
+    return _GAS_RATIO_TABLES[fo2_gas]
+
+def actual_fugacity(data, lookup=True):
+    """Calculates the actual oxygen fugacity (log Pa) from the measured gas flows and temperature for every row of data at once. Rows with no flow of the reducing (or oxidising) gas return nan.
+
+    :param data: experiment data containing co2, co, h2, fo2_gas, temp and fugacity columns
+    :type data: pd.DataFrame
+
+    :param lookup: interpolate from the precomputed :class:`GasRatioTable` rather than solving exactly. Defaults to True.
+    :type lookup: bool
+
+    :returns: oxygen fugacity (log Pa)
+    :rtype: np.ndarray
+    """
+    co = np.asarray(data.fo2_gas == 'co')
+    co2 = np.asarray(data.co2, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(co,
+            co2 / np.asarray(data.co, dtype=float),
+            co2 / np.asarray(data.h2, dtype=float))
+
+    temp = np.asarray(data.temp, dtype=float)
+    guess = np.asarray(data.fugacity, dtype=float)
+
+    result = np.full(ratio.shape, np.nan)
+    for mask, fo2_gas, func in [(co, 'co', fugacity_co), (~co, 'h2', fugacity_h2)]:
+        if not mask.any():
+            continue
+        if lookup:
+            result[mask] = gas_ratio_table(fo2_gas).fugacity(ratio[mask], temp[mask], guess[mask])
+        else:
+            result[mask] = fugacity_from_ratio(ratio[mask], temp[mask], func, guess[mask])
+    return result
 
 def to_complex_z(data):
     if data.z and data.theta:
@@ -309,6 +905,587 @@ def to_complex_z(data):
         imag = np.multiply(data.z, np.sin(data.theta))
         return real + 1j*imag
 
+def spectrum_matrix(complex_z, n_freq):
+    """Stacks a column of complex impedance arrays into a (rows x n_freq) array. Missing or partial sweeps are padded with nan."""
+    spectra = np.full((len(complex_z), n_freq), np.nan, dtype=complex)
+    for i, z in enumerate(complex_z):
+        if isinstance(z, np.ndarray):
+            spectra[i, :len(z)] = z
+    return spectra
+
+# bump whenever Sample.process_data changes what it produces, so stale processed caches are rebuilt
+PROCESSING_VERSION = 3
+
+def fingerprint(paths, previous=None):
+    """Identifies the contents of raw data files by size, modification time and sha1. Files whose size and modification time match previous (an earlier fingerprint) aren't rehashed.
+
+    :param paths: files to fingerprint
+    :param previous: an earlier fingerprint of the same files, optional
+    :return: dict of file name: [size, mtime_ns, sha1]
+    """
+    previous = previous or {}
+    result = {}
+    for path in paths:
+        stat = os.stat(path)
+        name = os.path.basename(path)
+        old = previous.get(name)
+        if old and old[0] == stat.st_size and old[1] == stat.st_mtime_ns:
+            result[name] = old
+            continue
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        result[name] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+    return result
+
+def same_files(a, b):
+    """Compares two fingerprints by size and hash only, so touching a file doesn't invalidate the cache"""
+    return a.keys() == b.keys() and all(a[k][0] == b[k][0] and a[k][2] == b[k][2] for k in a)
+
+def _encode_column(column, directory):
+    """Saves a single column as .npy files and returns a description of how to rebuild it, or None if the column needs pickling"""
+    name = column.name
+    path = lambda suffix='': os.path.join(directory, '{}{}.npy'.format(name, suffix))
+
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        np.save(path(), column.cat.codes.to_numpy())
+        return dict(kind='category', categories=column.cat.categories.tolist(), ordered=bool(column.cat.ordered))
+
+    if column.dtype != object:
+        values = column.to_numpy()
+        np.save(path(), values.view(np.dtype(values.dtype.str)))  # drops dtype metadata that npy can't store
+        return dict(kind='array')
+
+    null = column.isnull().to_numpy()
+    values = column[~null]
+    null_value = None if any(v is None for v in column[null]) else np.nan
+    if all(isinstance(v, str) for v in values):
+        labels, uniques = pd.factorize(column)
+        np.save(path(), labels.astype(np.int32))
+        return dict(kind='labels', uniques=uniques.tolist(), null=null_value is None)
+
+    if all(isinstance(v, (list, np.ndarray)) and np.ndim(v) == 1 for v in values):
+        lengths = np.array([0 if n else len(v) for n, v in zip(null, column)], dtype=np.int64)
+        is_complex = any(np.iscomplexobj(v) for v in values)
+        matrix = np.full((len(column), max(lengths.max(initial=0), 1)), np.nan, dtype=complex if is_complex else float)
+        for i, v in enumerate(column):
+            if lengths[i]:
+                matrix[i, :lengths[i]] = v
+        np.save(path(), matrix)
+        np.save(path('.lengths'), lengths)
+        return dict(kind='ragged', list=any(isinstance(v, list) for v in values), null=null_value is None)
+
+    return None
+
+def _decode_column(name, info, directory):
+    path = lambda suffix='': os.path.join(directory, '{}{}.npy'.format(name, suffix))
+    values = np.load(path(), mmap_mode='c')
+
+    if info['kind'] == 'array':
+        return pd.Series(values, name=name, copy=False)
+
+    if info['kind'] == 'category':
+        return pd.Series(pd.Categorical.from_codes(values, info['categories'], ordered=info['ordered']), name=name)
+
+    null = None if info['null'] else np.nan
+    column = np.empty(len(values), dtype=object)
+    if info['kind'] == 'labels':
+        uniques = np.array(info['uniques'] + [null], dtype=object)
+        column[:] = uniques[values]
+    else:
+        lengths = np.load(path('.lengths'))
+        for i, n in enumerate(lengths):
+            if not n:
+                column[i] = null
+            else:
+                column[i] = values[i, :n].tolist() if info['list'] else values[i, :n]
+    return pd.Series(column, name=name)
+
+def write_processed(directory, data, files, extra=None):
+    """Saves a processed dataframe to directory in a columnar layout that :func:`read_processed` can memory map: one .npy file per column, with string, categorical and array-per-row (e.g. spectra) columns encoded as numeric arrays. Anything else is pickled. The cache is tagged with the fingerprint of the raw files and PROCESSING_VERSION.
+
+    :param directory: folder for the cache, replaced if it exists
+    :param data: the processed dataframe
+    :param files: :func:`fingerprint` of the raw files data was processed from
+    :param extra: anything else to record about how data was processed (json serialisable), see :func:`processed_info`
+    """
+    tmp = '{}.tmp{}'.format(directory, os.getpid())
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    index = None
+    if not isinstance(data.index, pd.RangeIndex) or data.index.start != 0 or data.index.step != 1:
+        index = [name or 'index' for name in data.index.names]
+        data = data.reset_index()
+        data.columns = index + list(data.columns[len(index):])
+
+    columns, pickled = [], []
+    for i, name in enumerate(data.columns):
+        info = _encode_column(data.iloc[:, i].rename(i), tmp)
+        if info is None:
+            pickled.append(name)
+        columns.append([name, info])
+    if pickled:
+        data[pickled].to_pickle(os.path.join(tmp, 'objects.pkl'))
+
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(dict(version=PROCESSING_VERSION, files=files, index=index, rows=len(data), columns=columns, extra=extra), f)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp, directory)
+
+def processed_meta(directory):
+    """The meta.json written by :func:`write_processed` for the cache in directory, None if there is no cache"""
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def processed_info(directory):
+    """What else was recorded by :func:`write_processed` (extra) for the cache in directory, None if nothing"""
+    return (processed_meta(directory) or {}).get('extra')
+
+def read_processed(directory, paths):
+    """Loads a dataframe saved by :func:`write_processed`, memory mapping the numeric columns copy-on-write so they can be modified without changing the cache. Returns None if there is no cache, or the raw files at paths (not checked if None) or the processing code have changed since it was written."""
+    meta = processed_meta(directory)
+    if meta is None or meta.get('version') != PROCESSING_VERSION:
+        return None
+    if paths is not None and not same_files(fingerprint(paths, meta['files']), meta['files']):
+        return None
+
+    pickled = None
+    columns = {}
+    for i, (name, info) in enumerate(meta['columns']):
+        if info is None:
+            if pickled is None:
+                pickled = pd.read_pickle(os.path.join(directory, 'objects.pkl'))
+            columns[name] = pickled[name].reset_index(drop=True)
+        else:
+            columns[name] = _decode_column(i, info, directory)
+    data = pd.DataFrame(columns, copy=False)
+    if meta['index']:
+        data = data.set_index(meta['index'])
+    return data
+
+def time_rows(times, start=None, end=None):
+    """Rows of a sorted array of times between start and end (inclusive) as a slice. start and end can be anything pd.Timestamp accepts, or a pd.Timedelta from the first time."""
+    times = np.asarray(times, dtype='datetime64[ns]')
+    bounds = []
+    for value, default, side in ((start, 0, 'left'), (end, len(times), 'right')):
+        if value is None or not len(times):
+            bounds.append(default)
+            continue
+        if isinstance(value, (pd.Timedelta, timedelta)):
+            value = times[0] + pd.Timedelta(value).to_timedelta64()
+        bounds.append(int(np.searchsorted(times, pd.Timestamp(value).to_datetime64(), side=side)))
+    return slice(*bounds)
+
+def time_window(data, start=None, end=None, step=None):
+    """Rows of data measured between start and end, and optionally from a single step. Works on frames indexed by time (as from :func:`process_data`) or with a time column (as in :class:`Sample`). See :meth:`Sample.window`."""
+    times = data.index if isinstance(data.index, pd.DatetimeIndex) else pd.DatetimeIndex(data.time)
+    if times.is_monotonic_increasing:
+        rows = time_rows(times, start, end)
+    else:
+        rows = np.ones(len(data), dtype=bool)
+        if start is not None:
+            rows &= times >= (times.min() + start if isinstance(start, (pd.Timedelta, timedelta)) else pd.Timestamp(start))
+        if end is not None:
+            rows &= times <= (times.min() + end if isinstance(end, (pd.Timedelta, timedelta)) else pd.Timestamp(end))
+    data = data.iloc[rows]
+    if step is not None:
+        data = data[data.step == step]
+    return data
+
+def _intersect_rows(a, b):
+    """Rows in both a and b, each a slice or an array of positions. Two slices give a slice."""
+    if isinstance(a, slice) and isinstance(b, slice):
+        start = max(a.start, b.start)
+        return slice(start, max(start, min(a.stop, b.stop)))
+    positions = lambda rows: np.arange(rows.start, rows.stop) if isinstance(rows, slice) else rows
+    return np.intersect1d(positions(a), positions(b))
+
+def group_index(data, columns):
+    """Positions of the rows in each group of the given columns, found with one sort per column.
+
+    :param data: dataframe to index
+    :param columns: columns to group by
+    :return: dict of column: {value: rows} in order of first appearance, where rows is a slice when the group is contiguous and an array of positions otherwise. Missing values aren't indexed.
+    """
+    groups = {}
+    for column in columns:
+        codes, uniques = pd.factorize(data[column])
+        order = np.argsort(codes, kind='stable')
+        bounds = np.cumsum(np.bincount(codes[codes >= 0], minlength=len(uniques)))
+        start = np.count_nonzero(codes < 0)
+        groups[column] = {}
+        for value, end in zip(uniques, bounds + start):
+            rows = order[start:end]
+            if rows[-1] - rows[0] + 1 == len(rows):
+                rows = slice(rows[0], rows[-1] + 1)
+            groups[column][value] = rows
+            start = end
+    return groups
+
+class TemperatureIndex():
+    """Temperatures of the impedance measurements sorted once per run and per heating or cooling leg, so nearest-temperature lookups are a binary search rather than a scan of every row. A step belongs to the heating or cooling leg of its run by whether its target temperature is above or below the step before it, which for the first step of a run is the last step of the run before. Steps that hold the temperature take the direction of the step before them, even if it is in the previous run (or after them, at the start of the experiment).
+
+    :Example:
+
+    >>> index = TemperatureIndex(sample.data)
+    >>> rows = index.nearest([600, 800], run=1, leg='cooling')
+    >>> sample.spectra[rows]
+    """
+
+    def __init__(self, data):
+        """
+        Args:
+            data (pd.DataFrame): processed data with temp and complex_z columns, and optionally run and step
+        """
+        self.data = data
+        self.temp = data.temp.to_numpy(dtype=float)
+        self.runs = data.run.astype(object).to_numpy() if 'run' in data else np.full(len(data), None)
+        self.legs = np.full(len(data), None, dtype=object)
+        self._usable = data.complex_z.notnull().to_numpy() & np.isfinite(self.temp)
+        self._sorted = {}
+
+        if 'run' in data and 'step' in data:
+            target = data.target_temp if 'target_temp' in data else data.temp
+            # over the whole sequence of steps, so the first step of a run follows on from the last step of the one before
+            change = np.sign(target.groupby(data.step).mean().diff())
+            direction = change.replace(0, np.nan).ffill().bfill().fillna(1)
+            self.legs[:] = np.where(data.step.map(direction) > 0, 'heating', 'cooling')
+
+    def _index(self, run, leg):
+        key = (run, leg)
+        if key not in self._sorted:
+            mask = self._usable.copy()
+            if run is not None:
+                mask &= self.runs == run
+            if leg is not None:
+                mask &= self.legs == leg
+            positions = np.flatnonzero(mask)
+            order = np.argsort(self.temp[positions], kind='stable')
+            self._sorted[key] = self.temp[positions][order], positions[order]
+        return self._sorted[key]
+
+    def nearest(self, temps, run=None, leg=None):
+        """Positions in data of the impedance measurements closest to each of temps.
+
+        Args:
+            temps (float or list): temperatures in degrees C
+            run (int or str, optional): only search this run, e.g. 2 or 'Run 2'. Defaults to every run.
+            leg (str, optional): only search the 'heating' or 'cooling' leg of each run. Defaults to both.
+
+        Returns:
+            np.ndarray: one row position per temperature
+        """
+        if isinstance(run, (int, np.integer)):
+            run = 'Run {}'.format(run)
+        if leg not in (None, 'heating', 'cooling'):
+            raise ValueError("leg must be 'heating', 'cooling' or None")
+
+        sorted_temp, positions = self._index(run, leg)
+        if not len(positions):
+            raise ValueError('No impedance measurements for run={} leg={}'.format(run, leg))
+
+        temps = np.atleast_1d(np.asarray(temps, dtype=float))
+        above = np.clip(np.searchsorted(sorted_temp, temps), 0, len(positions) - 1)
+        below = np.clip(above - 1, 0, len(positions) - 1)
+        closer = np.abs(sorted_temp[below] - temps) <= np.abs(sorted_temp[above] - temps)
+        return positions[np.where(closer, below, above)]
+
+def _deep_size(value, matrix=None):
+    """Bytes used by a single value of an object column, including the floats in a list and the data of an array unless it is a view of matrix"""
+    if isinstance(value, list):
+        return sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value)
+    if isinstance(value, np.ndarray) and value.base is not None:
+        if matrix is not None and np.may_share_memory(value, matrix):
+            return sys.getsizeof(value)
+        return sys.getsizeof(value) + value.nbytes
+    return sys.getsizeof(value)
+
+def get_conductivity(resistance, area, thickness):
+    """Conductivity (S/m) from resistance (ohm) and the sample area (mm^2) and thickness (mm), as used by :class:`Sample`"""
+    return (thickness * 1e-3) / (np.asarray(resistance) * area * 1e-6)
+
+def get_Re_Im(z, theta):
+    """Real and imaginary impedance from magnitude and phase (in radians)"""
+    z, theta = np.asarray(z, dtype=float), np.asarray(theta, dtype=float)
+    return z * np.cos(theta), z * np.sin(theta)
+
+@lru_cache(maxsize=64)
+def _frequency_lookup(freq, at, method):
+    """Columns of the spectra either side of each requested frequency, the weight of the upper one, and the frequencies actually used"""
+    freq, at = np.array(freq), np.array(at)
+    log_f, log_at = np.log10(freq), np.log10(at)
+    if method == 'nearest':
+        i = np.abs(log_f[None, :] - log_at[:, None]).argmin(axis=1)
+        return i, i, np.zeros(len(at)), freq[i]
+    if method == 'log':
+        order = np.argsort(log_f)
+        position = np.interp(log_at, log_f[order], np.arange(len(freq)))
+        lower = np.floor(position).astype(int)
+        upper = np.minimum(lower + 1, len(freq) - 1)
+        return order[lower], order[upper], position - lower, 10 ** np.interp(position, np.arange(len(freq)), log_f[order])
+    raise ValueError("method must be 'nearest' or 'log'")
+
+def impedance_at(freq, spectra, at, part='complex', method='nearest'):
+    """Impedance of every spectrum at one or more frequencies, taken from the whole spectrum matrix at once. The columns to read are looked up once per set of frequencies and cached.
+
+    Args:
+        freq (array): measured frequencies, one per column of spectra
+        spectra (array): complex impedance, (rows x frequencies)
+        at (float or list): requested frequencies in Hz
+        part (str, optional): 'complex', 'real', 'imag', 'abs' or 'phase' (radians). Defaults to 'complex'.
+        method (str, optional): 'nearest' measured frequency, or 'log' to interpolate log|Z| and phase linearly in log frequency. Requests outside the measured range use the end frequencies. Defaults to 'nearest'.
+
+    Returns:
+        tuple: (values, frequencies). values is (rows,) for a single requested frequency and (rows x frequencies) otherwise. frequencies are those actually used.
+    """
+    lower, upper, weight, used = _frequency_lookup(
+        tuple(np.asarray(freq, dtype=float)), tuple(np.atleast_1d(at).astype(float)), method)
+    spectra = np.asarray(spectra)
+    z = spectra[..., lower]
+    if method == 'log':
+        high = spectra[..., upper]
+        with np.errstate(divide='ignore'):
+            log_abs = (1 - weight) * np.log(np.abs(z)) + weight * np.log(np.abs(high))
+        z = np.exp(log_abs + 1j * ((1 - weight) * np.angle(z) + weight * np.angle(high)))
+
+    values = dict(
+        complex = lambda: z,
+        real = lambda: z.real,
+        imag = lambda: z.imag,
+        abs = lambda: np.abs(z),
+        phase = lambda: np.angle(z),
+        )
+    if part not in values:
+        raise ValueError("part must be one of {}".format(', '.join(values)))
+    values = values[part]()
+    if np.ndim(at) == 0:
+        return values[..., 0], used[0]
+    return values, used
+
+def thermopower_table(sample):
+    """Thermopower of every step from a weighted least squares fit of voltage against thermal gradient, weighted by 1/volt_stderr^2. All steps are fitted together from closed-form weighted sums rather than one statsmodels fit per step. When given a :class:`Sample` the table is computed once and kept on the sample.
+
+    Args:
+        sample (Sample or pd.DataFrame): a sample or its processed data
+
+    Returns:
+        pd.DataFrame: one row per step with the number of measurements (n), slope, intercept and their standard errors, thermopower (-slope, micro V/K) and the mean temperature, fugacity and gradient of the step. Steps with fewer than three valid measurements have nan standard errors.
+    """
+    if isinstance(sample, Sample):
+        if getattr(sample, '_thermopower_table', None) is None:
+            sample.require('temp', 'actual_fugacity')
+            sample._thermopower_table = _thermopower_table(sample.thermopower)
+        return sample._thermopower_table
+    return _thermopower_table(sample[sample.complex_z.isnull()])
+
+def _thermopower_table(data):
+    gradient = (data.thermo_1 - data.thermo_2).to_numpy(dtype=float)
+    voltage = data.voltage.to_numpy(dtype=float)
+    w = 1. / data.volt_stderr.to_numpy(dtype=float) ** 2
+    ok = np.isfinite(gradient) & np.isfinite(voltage) & np.isfinite(w) & (w > 0)
+
+    steps, group = np.unique(data.step.to_numpy()[ok], return_inverse=True)
+    x, y, w = gradient[ok], voltage[ok], w[ok]
+    sums = lambda values: np.bincount(group, weights=values, minlength=len(steps))
+
+    n = np.bincount(group, minlength=len(steps))
+    sw = sums(w)
+    x_mean, y_mean = sums(w * x) / sw, sums(w * y) / sw
+    dx, dy = x - x_mean[group], y - y_mean[group]
+    sxx, sxy = sums(w * dx * dx), sums(w * dx * dy)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(n > 1, sxy / sxx, np.nan)
+        intercept = y_mean - slope * x_mean
+        scale = sums(w * (dy - slope[group] * dx) ** 2) / np.where(n > 2, n - 2, np.nan)
+        slope_stderr = np.sqrt(scale / sxx)
+        intercept_stderr = np.sqrt(scale * (1 / sw + x_mean ** 2 / sxx))
+
+    table = pd.DataFrame(dict(
+        n = n,
+        slope = slope,
+        intercept = intercept,
+        slope_stderr = slope_stderr,
+        intercept_stderr = intercept_stderr,
+        thermopower = -slope,
+        gradient = x_mean,
+        ), index=pd.Index(steps, name='step'))
+
+    means = data[ok].groupby('step')[[c for c in ('temp', 'actual_fugacity', 'log10_fugacity') if c in data]].mean()
+    table = table.join(means)
+    if 'hold_length' in data:
+        table['hold_length'] = data[ok].groupby('step').hold_length.first()
+    return table
+
+def thermopower_summary(data, step):
+    """Full statsmodels WLS fit of voltage against thermal gradient for a single step, for when more than the slope is needed (e.g. ``thermopower_summary(sample, 4).summary()``). See :func:`thermopower_table` for the thermopower of every step."""
+    import statsmodels.api as sm
+
+    if isinstance(data, Sample):
+        data = data.thermopower
+    data = data[(data.step == step) & data.complex_z.isnull()]
+    gradient = (data.thermo_1 - data.thermo_2).rename('gradient')
+    return sm.WLS(data.voltage, sm.add_constant(gradient), weights=1. / (data.volt_stderr ** 2)).fit()
+
+_POOLS = {}
+
+def process_pool(workers=None):
+    """A pool of worker processes shared by every call that asks for the same number of workers, so repeated loads don't pay for starting processes again. Pools are shut down when Python exits."""
+    workers = workers or os.cpu_count()
+    if workers not in _POOLS:
+        _POOLS[workers] = ProcessPoolExecutor(workers)
+    return _POOLS[workers]
+
+@atexit.register
+def _shutdown_pools():
+    for pool in _POOLS.values():
+        if sys.version_info >= (3, 9):
+            pool.shutdown(wait=False, cancel_futures=True)
+        else:
+            pool.shutdown(wait=False)
+    _POOLS.clear()
+
+def _process_sample(project_folder, derived):
+    """Runs in a worker of :func:`load_samples`. Processes a sample into its processed data cache, so only the folder name is sent back."""
+    Sample(project_folder, cache=True, derived=derived)
+    return os.path.isfile(os.path.join(project_folder, config.PROCESSED_DIR, 'meta.json'))
+
+def load_samples(paths, workers=None, derived=None, progress=True):
+    """Loads several experiments, processing them in parallel. Each worker writes its sample to the processed data cache (see :meth:`Sample.load_data`) and the samples are then opened from there with their columns memory mapped, so the frames are never pickled between processes.
+
+    Args:
+        paths (list): project folders
+        workers (int, optional): number of processes. 1 loads in the current process, None uses every core. Defaults to None.
+        derived (list, optional): derived columns to compute, see :class:`Sample`. Defaults to every derived column.
+        progress (bool, optional): display a progress bar. Defaults to True.
+
+    Returns:
+        list: a :class:`Sample` for each of paths, in the same order
+    """
+    paths = list(paths)
+    if workers == 1 or len(paths) < 2:
+        return [Sample(path, derived=derived) for path in tqdm(paths, desc='Loading samples', disable=not progress)]
+
+    pool = process_pool(workers)
+    futures = {pool.submit(_process_sample, path, derived): path for path in paths}
+    with tqdm(total=len(paths), desc='Loading samples', disable=not progress) as progress_bar:
+        for future in as_completed(futures):
+            if not future.result():
+                warnings.warn('{} could not be cached, it will be processed again'.format(futures[future]))
+            progress_bar.update(1)
+
+    return [Sample(path, derived=derived) for path in paths]
+
+def concat_samples(samples, columns=None):
+    """The data of several samples as one dataframe with a (sample, row) MultiIndex, for plots across experiments. Samples are labelled by their folder name.
+
+    :param samples: list of :class:`Sample`
+    :param columns: columns to keep, which saves copying the spectra when they aren't needed. Defaults to every column.
+    :return: pd.DataFrame
+    """
+    frames = []
+    for sample in samples:
+        if columns is not None:
+            sample.require(*columns)
+        frames.append(sample.data if columns is None else sample.data[columns])
+    keys = [os.path.basename(os.path.normpath(sample.directory)) for sample in samples]
+    return pd.concat(frames, keys=keys, names=['sample', 'row'], sort=False)
+
+def raw_chunks(project_folder):
+    """Raw data of an experiment in time order, one piece at a time. Reads the per-step files in config.STEPS_DIR that Experiment saves, one step per chunk. Older experiments without them are read from data.pkl, which has to fit in memory once, in chunks of config.CHUNK_ROWS rows.
+
+    :return: generator of (source file, raw dataframe)
+    """
+    steps = sorted(glob.glob(os.path.join(project_folder, config.STEPS_DIR, 'step_*.pkl')))
+    if steps:
+        for path in steps:
+            yield path, pd.read_pickle(path)
+        return
+
+    path = glob.glob(os.path.join(project_folder, '*.pkl'))[0]
+    data = pd.read_pickle(path).sort_index(kind='stable')
+    for start in range(0, len(data), config.CHUNK_ROWS):
+        yield path, data.iloc[start:start + config.CHUNK_ROWS].copy()
+
+def process_chunks(project_folder, fit=False, circuit='p(R1,C1)-p(R2,C2)', guess=[1e+5, 1e-10, 5e+6, 1e-10], ignore_below=200, progress=True):
+    """Processes (and optionally fits) an experiment one chunk at a time, see :func:`raw_chunks`, so experiments too large for memory can be reduced. Times from the start of the experiment and of each step are carried across chunks, and run labels come from the control file so they agree between chunks. Each processed chunk is written to the processed data cache (config.PROCESSED_DIR/chunks), along with the circuit, guess, cutoff and :data:`modelling.FITTER_VERSION` it was fitted with (fits that did not succeed are saved as nan), and chunks whose raw file hasn't changed since (and that were fitted the same way, if fit) are skipped. Read them back with :func:`read_chunks`.
+
+    Args:
+        fit (bool, optional): fit circuit to the spectra of each chunk and save resistance, model_rmse and conductivity. See :func:`modelling.fit_batch`. Defaults to False.
+        progress (bool, optional): display a progress bar. Defaults to True.
+
+    Returns:
+        list: folders of the processed chunks in time order
+    """
+    sample = Sample(project_folder, load=False)
+    info = [os.path.join(project_folder, name) for name in ['sample.json', 'control_file.csv']]
+    folder = os.path.join(project_folder, config.PROCESSED_DIR, 'chunks')
+    # recorded with each chunk, live fits from the acquisition PC may already have left a resistance column
+    fitting = dict(circuit=circuit, guess=[float(g) for g in guess], cutoff=ignore_below, version=modelling.FITTER_VERSION) if fit else None
+
+    origin, step_start, chunks = None, {}, []
+    for n, (source, raw) in enumerate(tqdm(raw_chunks(project_folder), desc='Processing chunks', disable=not progress)):
+        directory = os.path.join(folder, '{:05d}'.format(n))
+        chunks.append(directory)
+
+        data = read_processed(directory, [source] + info)
+        fitted = (processed_info(directory) or {}).get('fit')
+        if data is None or (fit and fitted != fitting):
+            time = raw.index.to_series()
+            origin = time.iloc[0] if origin is None else origin
+            raw['time_elapsed'] = time - origin
+            first = time.groupby(raw.step.values).transform('first')
+            raw['time_from_step'] = time - raw.step.map(step_start).fillna(first)
+            data = sample.process_data(raw)
+
+            if fit:
+                result = modelling.fit_cached(
+                    freq = sample.freq,
+                    spectra = spectrum_matrix(data.complex_z, len(sample.freq)),
+                    cutoff = ignore_below,
+                    circuit = circuit,
+                    guess = guess,
+                    fitter = modelling.fit_batch,
+                    progress = False,
+                    )
+                # fits that failed are left out rather than saved with the chunk for good
+                ok = np.array([modelling.succeeded(r[0], r[2]) for r in result], dtype=bool)
+                data['resistance'] = np.where(ok, [r[1] for r in result], np.nan)
+                data['model_rmse'] = np.where(ok, [r[2] for r in result], np.nan)
+                data['conductivity'] = get_conductivity(data['resistance'], sample.area, sample.thickness)
+
+            write_processed(directory, data, fingerprint([source] + info), extra=dict(fit=fitting))
+
+        # carried on to the next chunk
+        origin = data.time.iloc[0] if origin is None else origin
+        for step, time in data.groupby('step').time.first().items():
+            step_start.setdefault(step, time)
+        del data, raw
+
+    # chunks left over from a previous, longer, processing of the data
+    for stale in sorted(glob.glob(os.path.join(folder, '*'))):
+        if stale not in chunks:
+            shutil.rmtree(stale, ignore_errors=True)
+    return chunks
+
+def read_chunks(project_folder, columns=None):
+    """The chunks written by :func:`process_chunks`, in time order and with their numeric columns memory mapped, for reductions that only need one chunk in memory at a time.
+
+    :param columns: columns to keep. Defaults to every column.
+    :return: generator of dataframes
+    """
+    for directory in sorted(glob.glob(os.path.join(project_folder, config.PROCESSED_DIR, 'chunks', '*'))):
+        data = read_processed(directory, None)
+        if data is None:
+            continue
+        yield data if columns is None else data[columns]
+
 def load_data(project_folder):
     """loads a previous experiment for processing and analysis
 
@@ -340,7 +1517,7 @@ def process_data(data, sample_area, sample_thickness):
     data['temp'] = data[['thermo_1','thermo_2']].mean(axis=1)
     data['kelvin'] = data.temp+273.18
     data['gradient'] = data.thermo_1 - data.thermo_2
-    data['actual_fugacity'] = data.apply(lambda x: actual_fugacity(x), axis=1)
+    data['actual_fugacity'] = actual_fugacity(data)
     data['complex_z'] = data.apply(lambda x: to_complex_z(x), axis=1)
     # data['resistance'] = data.apply(lambda x: fit_impedance(x,offset=5), axis=1)
 
@@ -0,0 +1,77 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from laboratory import config, processing
+
+FREQ = np.around(np.geomspace(20, 2e6, 50))
+
+def arrhenius(kelvin):
+    """Resistances of the two arcs of the synthetic sample at a temperature"""
+    R1 = 1e5 * np.exp(2000 * (1/kelvin - 1/1073))
+    return R1, 5 * R1
+
+def spectrum(kelvin, freq=FREQ):
+    """Impedance of p(R1,C1)-p(R2,C2) with thermally activated resistances"""
+    R1, R2 = arrhenius(kelvin)
+    w = 2 * np.pi * np.asarray(freq)
+    return R1 / (1 + 1j*w*R1*1e-10) + R2 / (1 + 1j*w*R2*3e-9)
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Keeps gas ratio tables and fits out of the package cache"""
+    monkeypatch.setattr(config, 'CACHE_DIR', str(tmp_path / 'cache'))
+
+@pytest.fixture
+def experiment(tmp_path):
+    """A small project folder laid out like the output of the lab software: a heating and cooling run with one thermopower step"""
+    rng = np.random.default_rng(0)
+    folder = tmp_path / 'experiment'
+    folder.mkdir()
+
+    control_file = pd.DataFrame(dict(
+        target_temp=[600, 800, 1000, 1000, 800, 600, 800],
+        hold_length=[0, 0, 0, 5, 0, 0, 0],
+        heat_rate=[5] * 7,
+        interval=[10] * 7,
+        buffer=['qfm'] * 4 + ['qif'] * 3,
+        offset=[0, 0, 0, 1, -1, 0, 0],
+        fo2_gas=['co'] * 4 + ['h2'] * 3,
+        thermopower=[0, 0, 0, 2, 0, 0, 0]))
+    control_file.to_csv(folder / 'control_file.csv')
+
+    rows = []
+    time = pd.Timestamp('2020-11-01 08:00')
+    previous = control_file.target_temp.shift().fillna(25)
+    for step, s in control_file.iterrows():
+        for i in range(8):
+            T = previous[step] + (s.target_temp - previous[step]) * (i + 1) / 8 + rng.normal(0, 1)
+            fugacity = processing.fo2_buffer(T, s.buffer) + s.offset
+            if s.fo2_gas == 'co':
+                ratio = processing.fugacity_co(fugacity, T)
+                co2, co, h2 = 25.0, round(25.0 / ratio, 3), 0.0
+            else:
+                ratio = processing.fugacity_h2(fugacity, T)
+                co2, co, h2 = round(25.0 * ratio, 2), 0.0, 25.0
+            Z = spectrum(T + 273.15) * (1 + rng.normal(0, 0.005, len(FREQ)))
+            g = rng.normal(0, 1)
+            row = dict(time=time, step=step, thermo_1=T + g/2, thermo_2=T - g/2,
+                voltage=-100*g + rng.normal(0, 2), volt_stderr=abs(rng.normal(1, .2)) + .1,
+                co2=co2, co=co, h2=h2, fugacity=fugacity, ratio=ratio, x_position=5488,
+                target=s.target_temp, indicated=T + 3, z=list(np.abs(Z)), theta=list(np.angle(Z)))
+            if s.thermopower and i % 2:
+                # thermopower measurements have no spectrum
+                row.pop('z')
+                row.pop('theta')
+            rows.append(row)
+            time = time + pd.Timedelta(minutes=10)
+    pd.DataFrame(rows).set_index('time').to_pickle(folder / 'data.pkl')
+
+    with open(folder / 'sample.json', 'w') as f:
+        json.dump(dict(area=97.686, thickness=2.6, freq=list(FREQ), name='test sample',
+            description='synthetic', material='olivine'), f)
+
+    return str(folder)
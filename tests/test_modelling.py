@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+from impedance.models.circuits import CustomCircuit
+
+from laboratory import config, modelling
+from conftest import FREQ, arrhenius, spectrum
+
+CIRCUITS = dict(config.CIRCUITS, **{'R0-p(R1,CPE1)-W1': [1e+3, 1e+6, 1e-10, 0.8, 1e+5]})
+
+@pytest.mark.parametrize('circuit', CIRCUITS)
+def test_compiled_circuit_matches_impedance(circuit):
+    guess = CIRCUITS[circuit]
+    expected = CustomCircuit(circuit, initial_guess=guess).predict(FREQ, use_initial=True)
+    np.testing.assert_allclose(modelling.CompiledCircuit(circuit)(guess, FREQ), expected, rtol=1e-12)
+
+def test_compiled_jacobian_matches_finite_differences():
+    circuit = 'p(R1,C1)-p(R2,CPE1)'
+    guess = np.array(CIRCUITS[circuit])
+    compiled = modelling.CompiledCircuit(circuit)
+    _, J = compiled(guess, FREQ, jacobian=True)
+    for k in range(len(guess)):
+        h = np.zeros_like(guess)
+        h[k] = guess[k] * 1e-6
+        numeric = (compiled(guess + h, FREQ) - compiled(guess - h, FREQ)) / (2 * h[k])
+        np.testing.assert_allclose(J[..., k], numeric, rtol=1e-5, atol=1e-12 * np.abs(numeric).max())
+
+def test_fit_batch_recovers_parameters():
+    kelvin = np.linspace(900, 1300, 5)
+    spectra = np.array([spectrum(T) for T in kelvin])
+    spectra[2] = np.nan
+    results = modelling.fit_batch(FREQ, spectra, 0, 'p(R1,C1)-p(R2,C2)', config.CIRCUITS['p(R1,C1)-p(R2,C2)'], progress=False)
+
+    assert np.isnan(results[2][1])
+    for T, (model, resistance, rmse) in zip(kelvin[[0, 1, 3, 4]], [results[i] for i in [0, 1, 3, 4]]):
+        assert modelling.succeeded(model, rmse)
+        np.testing.assert_allclose(resistance, sum(arrhenius(T)), rtol=1e-6)
+
+def test_fit_batch_refits_failed_rows(monkeypatch):
+    kelvin = np.linspace(900, 1300, 3)
+    spectra = np.array([spectrum(T) for T in kelvin])
+    batched = modelling.levenberg_marquardt
+
+    def levenberg_marquardt(*args, **kwargs):
+        fit = batched(*args, **kwargs)
+        fit['success'][1:] = False
+        return fit
+
+    single = modelling.fit_circuit
+    def fit_circuit(circuit, guess, freq, impedance):
+        fit = single(circuit, guess, freq, impedance)
+        if np.allclose(impedance, spectra[2]):
+            fit['success'] = False
+        return fit
+
+    monkeypatch.setattr(modelling, 'levenberg_marquardt', levenberg_marquardt)
+    monkeypatch.setattr(modelling, 'fit_circuit', fit_circuit)
+    results = modelling.fit_batch(FREQ, spectra, 0, 'p(R1,C1)-p(R2,C2)', config.CIRCUITS['p(R1,C1)-p(R2,C2)'], progress=False)
+
+    # the first row kept its batched fit, the second was refitted and the third failed both ways
+    assert modelling.succeeded(results[0][0], results[0][2])
+    assert modelling.succeeded(results[1][0], results[1][2])
+    np.testing.assert_allclose(results[1][1], sum(arrhenius(kelvin[1])), rtol=1e-6)
+    assert all(np.isnan(value) for value in results[2])
+
+def test_fit_batch_failed_fits_are_never_returned():
+    # R0 runs to zero on spectra without a series resistance
+    spectra = np.array([spectrum(T) for T in np.linspace(900, 1300, 4)])
+    results = modelling.fit_batch(FREQ, spectra, 0, 'R0-p(R1,C1)-p(R2,C2)', [1e3, 1e5, 1e-10, 5e6, 1e-10], progress=False)
+    for model, resistance, rmse in results:
+        assert np.isnan(resistance) or modelling.succeeded(model, rmse)
+
+@pytest.mark.parametrize('mode', ['previous', 'interpolate'])
+def test_fit_sequential_falls_back_after_divergence(monkeypatch, mode):
+    circuit, guess = 'p(R1,C1)-p(R2,C2)', config.CIRCUITS['p(R1,C1)-p(R2,C2)']
+    kelvin = np.linspace(900, 1300, 4)
+    spectra = np.array([spectrum(T) for T in kelvin])
+    single = modelling.fit_circuit
+    seeds = []
+
+    def fit_circuit(circuit, seed, freq, impedance):
+        # every fit that doesn't start from the global guess runs away
+        seeds.append(np.array(seed))
+        fit = single(circuit, seed, freq, impedance)
+        if not np.array_equal(seed, guess):
+            fit['parameters'] = fit['parameters'] * 1e6
+        return fit
+
+    monkeypatch.setattr(modelling, 'fit_circuit', fit_circuit)
+    results = modelling.fit_sequential(FREQ, spectra, 0, circuit, guess, kelvin=kelvin, mode=mode, progress=False)
+
+    assert len(seeds) == 2 * len(spectra) - 1
+    for T, (model, resistance, rmse, nfev) in zip(kelvin, results):
+        assert modelling.succeeded(model, rmse)
+        np.testing.assert_allclose(resistance, sum(arrhenius(T)), rtol=1e-6)
+
+def test_fit_sequential_interpolation_is_bounded():
+    # nearly equal temperatures with a small change in the spectra would extrapolate far outside the data
+    circuit, guess = 'p(R1,C1)-p(R2,C2)', config.CIRCUITS['p(R1,C1)-p(R2,C2)']
+    kelvin = np.array([1000, 1000.001, 1000.002, 1100])
+    spectra = np.array([spectrum(T) for T in [1000, 1010, 1020, 1100]])
+    results = modelling.fit_sequential(FREQ, spectra, 0, circuit, guess, kelvin=kelvin, mode='interpolate', progress=False)
+
+    for T, (model, resistance, rmse, nfev) in zip([1000, 1010, 1020, 1100], results):
+        assert modelling.succeeded(model, rmse)
+        np.testing.assert_allclose(resistance, sum(arrhenius(T)), rtol=1e-6)
+
+def test_fit_cached_skips_failed_fits():
+    spectra = np.array([spectrum(T) for T in [1000, 1100]])
+    cache = modelling.FitCache()
+
+    def fitter(freq, spectra, cutoff, circuit, guess, **kwargs):
+        results = modelling.fit_spectra(freq, spectra, cutoff, circuit, guess, progress=False)
+        model, resistance, rmse = results[1]
+        return [results[0], (model, resistance, np.nan)]
+
+    modelling.fit_cached(FREQ, spectra, 0, 'p(R1,C1)-p(R2,C2)', config.CIRCUITS['p(R1,C1)-p(R2,C2)'], fitter=fitter, cache=cache)
+    assert len(cache) == 1
@@ -0,0 +1,73 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from laboratory import config, processing
+
+def cached_columns(experiment):
+    with open(os.path.join(experiment, config.PROCESSED_DIR, 'meta.json')) as f:
+        return [column[0] for column in json.load(f)['columns']]
+
+def test_cache_round_trip(experiment):
+    expected = processing.Sample(experiment, cache=False).data
+    processing.Sample(experiment)
+    cached = processing.Sample(experiment).data
+    pd.testing.assert_frame_equal(cached[expected.columns], expected)
+
+def test_cache_adds_derived_columns(experiment):
+    partial = processing.Sample(experiment, derived=['temp']).data
+    assert 'complex_z' not in cached_columns(experiment)
+
+    # a later full load derives the rest and writes them back to the cache
+    full = processing.Sample(experiment).data
+    columns = cached_columns(experiment)
+    assert {'complex_z', 'actual_fugacity'} <= set(columns)
+    assert set(partial.columns) < set(columns)
+
+    expected = processing.Sample(experiment, cache=False).data
+    cached = processing.Sample(experiment).data
+    assert cached_columns(experiment) == columns
+    pd.testing.assert_frame_equal(full[expected.columns], expected)
+    pd.testing.assert_frame_equal(cached[expected.columns], expected)
+
+def test_cache_is_rebuilt_when_raw_data_changes(experiment):
+    processing.Sample(experiment)
+    raw = pd.read_pickle(os.path.join(experiment, 'data.pkl'))
+    raw['voltage'] = raw.voltage + 1
+    raw.to_pickle(os.path.join(experiment, 'data.pkl'))
+
+    np.testing.assert_allclose(processing.Sample(experiment).data.voltage, processing.Sample(experiment, cache=False).data.voltage)
+
+def test_thermopower_table_matches_polyfit(experiment):
+    sample = processing.Sample(experiment)
+    table = processing.thermopower_table(sample)
+    data = sample.thermopower
+
+    assert len(table) == data.step.nunique()
+    for step, group in data.groupby('step'):
+        gradient = group.thermo_1 - group.thermo_2
+        (slope, intercept), covariance = np.polyfit(gradient, group.voltage, 1, w=1/group.volt_stderr, cov='unscaled')
+        residuals = group.voltage - (slope * gradient + intercept)
+        scale = np.sum((residuals / group.volt_stderr) ** 2) / (len(group) - 2)
+
+        row = table.loc[step]
+        np.testing.assert_allclose([row.slope, row.intercept, row.thermopower], [slope, intercept, -slope], rtol=1e-9)
+        np.testing.assert_allclose([row.slope_stderr, row.intercept_stderr], np.sqrt(np.diag(covariance) * scale), rtol=1e-9)
+        assert row.n == len(group)
+
+def test_temperature_index_legs():
+    # the hold at 1000 starts the second run and continues the heating leg of the first
+    target = [600, 800, 1000, 1000, 800, 600]
+    data = pd.DataFrame(dict(
+        step = np.repeat(range(6), 2),
+        run = np.repeat(['Run 1'] * 3 + ['Run 2'] * 3, 2),
+        target_temp = np.repeat(target, 2),
+        temp = np.repeat(target, 2) + np.tile([-5, 5], 6),
+        complex_z = [1 + 1j] * 12,
+        ))
+    index = processing.TemperatureIndex(data)
+
+    np.testing.assert_array_equal(index.legs, np.repeat(['heating'] * 4 + ['cooling'] * 2, 2))
+    np.testing.assert_array_equal(index.nearest([810, 590], run=2, leg='cooling'), [9, 10])
@@ -9,6 +9,7 @@ import os
 import json
 from dash.exceptions import PreventUpdate
 from laboratory.processing import Sample
+from laboratory import catalog
 import time
 from dash.dash import no_update
 import copy 
@@ -44,10 +45,9 @@ def experiment_card(data):
 
 
 def layout():
-    card_data = []
-    for experiment in [d for d in os.listdir('data') if not d.startswith('_')]:
-        with open(os.path.join('data',experiment,'sample.json')) as sample:
-            card_data.append({**json.load(sample),'dir':experiment})
+    # only experiments added or changed since the last visit are read from disk
+    experiments = catalog.catalog().experiments()
+    card_data = [{**json.loads(metadata),'dir':experiment} for experiment, metadata in experiments.metadata.items()]
 
     return [
         comp.header('Previous Experiments'),